@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+直接读取 CBZ/ZIP（以及装有 py7zr 时的 CB7/7z）压缩包中的图片，不解压到磁盘。
+
+压缩包中的图片用“压缩包路径/成员名”形式的虚拟路径表示，可以像普通文件路径
+一样放进图片列表、分析缓存和进度记录。打开 ZIP 只读取文件末尾的中央目录，
+所以再大的压缩包也能立即打开，并且可以直接读取任意一页；最近读取过的成员
+字节保存在一个小的内存缓存中。本模块不依赖 Qt。
+"""
+import io
+import os
+import threading
+import zipfile
+
+from imagecache import LruTier
+
+try:
+    import py7zr
+except ImportError:
+    py7zr = None
+
+ZIP_EXTENSIONS = {'.cbz', '.zip'}
+SEVEN_ZIP_EXTENSIONS = {'.cb7', '.7z'}
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS | (SEVEN_ZIP_EXTENSIONS if py7zr is not None else set())
+
+DEFAULT_CACHE_MB = 64
+HEADER_BYTES = 64 * 1024  # Enough of a member to find its image size
+
+
+def is_archive(path):
+    return os.path.splitext(path)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def split_path(path):
+    """
+    Split the virtual path of an archive member.
+
+    :return: (archive path, member name), or None for an ordinary file path
+    """
+    start = 0
+    while True:
+        sep = path.find(os.sep, start)
+        if sep < 0:
+            return None
+        if is_archive(path[:sep]) and os.path.isfile(path[:sep]):
+            return path[:sep], path[sep + 1:]
+        start = sep + 1
+
+
+def member_path(archive, name):
+    return archive + os.sep + name
+
+
+class ZipArchive:
+    """Random access to the members of a ZIP file through its central directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+
+    def names(self):
+        return [info.filename for info in self._zip.infolist() if not info.is_dir()]
+
+    def size(self, name):
+        return self._zip.getinfo(name).file_size
+
+    def read(self, name):
+        return self._zip.read(name)
+
+    def head(self, name, nbytes):
+        with self._zip.open(name) as f:
+            return f.read(nbytes)
+
+    def close(self):
+        self._zip.close()
+
+
+class SevenZipArchive:
+    """
+    Members of a 7z file (needs py7zr).
+
+    Solid 7z archives can only be decompressed from the start of a block, so
+    reading a page late in the archive costs more than in a ZIP; the byte
+    cache hides this while reading forward.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with py7zr.SevenZipFile(path) as z:
+            self._sizes = {info.filename: info.uncompressed for info in z.list() if not info.is_directory}
+
+    def names(self):
+        return list(self._sizes)
+
+    def size(self, name):
+        return self._sizes[name]
+
+    def read(self, name):
+        with self._lock, py7zr.SevenZipFile(self.path) as z:
+            return z.read([name])[name].read()
+
+    def head(self, name, nbytes):
+        # Would decompress the whole block; sizes are learnt when pages are decoded.
+        return b""
+
+    def close(self):
+        pass
+
+
+class ArchiveRegistry:
+    """
+    Open archives shared by all threads, with an LRU cache of member bytes.
+
+    An archive is reopened when its size or modification time changed.
+    """
+
+    def __init__(self, cache_mb=DEFAULT_CACHE_MB):
+        self._lock = threading.Lock()
+        self._archives = {}  # path -> ((size, mtime_ns), archive)
+        self.cache = LruTier("archive", cache_mb * 1024 * 1024)
+
+    def open(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        signature = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._archives.get(path)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            if entry is not None:
+                entry[1].close()
+            if os.path.splitext(path)[1].lower() in ZIP_EXTENSIONS:
+                archive = ZipArchive(path)
+            else:
+                archive = SevenZipArchive(path)
+            self._archives[path] = (signature, archive)
+            return archive
+
+    def signature(self, path):
+        """(member size, archive mtime_ns) of a member path, used like a file signature."""
+        archive_path, name = split_path(path)
+        archive = self.open(archive_path)
+        try:
+            size = archive.size(name)
+        except KeyError:
+            raise FileNotFoundError(path) from None
+        return size, os.stat(archive_path).st_mtime_ns
+
+    def read(self, path):
+        """Return the bytes of the member at virtual ``path``."""
+        archive_path, name = split_path(path)
+        archive = self.open(archive_path)
+        key = (archive.path, name)
+        with self._lock:
+            data = self.cache.get(key)
+        if data is None:
+            data = archive.read(name)
+            with self._lock:
+                self.cache.put(key, data, len(data))
+        return data
+
+    def head(self, path, nbytes=HEADER_BYTES):
+        archive_path, name = split_path(path)
+        return self.open(archive_path).head(name, nbytes)
+
+    def close(self):
+        with self._lock:
+            for _, archive in self._archives.values():
+                archive.close()
+            self._archives.clear()
+            self.cache.clear()
+
+
+registry = ArchiveRegistry()
+
+
+def head_stream(path):
+    """A seekable stream over the first bytes of an archive member (for header parsing)."""
+    return io.BytesIO(registry.head(path))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+自动滚动与滚动速度估计。
+
+自动滚动按固定帧率推进滚动条，每帧按实际经过的时间计算位移，帧率波动时
+速度依然均匀；超过 1.5 倍帧间隔的帧计为掉帧。滚动速度（手动或自动）用于
+决定沿滚动方向预读多少页。
+"""
+import math
+import time
+
+from PyQt5.QtCore import QElapsedTimer, QObject, Qt, QTimer, pyqtSignal
+
+DEFAULT_SPEED = 600     # Pixels per second
+MIN_SPEED = 50
+MAX_SPEED = 20000
+SPEED_STEP = 1.25       # Factor applied by faster() / slower()
+FRAME_MS = 16           # About 60 frames per second
+DROPPED_FRAME_RATIO = 1.5
+
+
+class ScrollVelocity:
+    """
+    Exponentially smoothed scroll velocity in pixels per second.
+
+    ``sample`` is fed every scroll bar position; once no new sample has
+    arrived for ``grace`` seconds the estimate decays to 0 with the same time
+    constant.
+    """
+
+    def __init__(self, time_constant=0.25, grace=0.1):
+        self.time_constant = time_constant
+        self.grace = grace
+        self._velocity = 0.0
+        self._last_value = None
+        self._last_time = 0.0
+
+    def reset(self):
+        self._velocity = 0.0
+        self._last_value = None
+
+    def sample(self, value):
+        now = time.perf_counter()
+        if self._last_value is not None:
+            dt = now - self._last_time
+            if dt > 0:
+                weight = 1.0 - math.exp(-dt / self.time_constant)
+                self._velocity += weight * ((value - self._last_value) / dt - self._velocity)
+        self._last_value = value
+        self._last_time = now
+
+    def velocity(self):
+        if self._last_value is None:
+            return 0.0
+        idle = max(0.0, time.perf_counter() - self._last_time - self.grace)
+        return self._velocity * math.exp(-idle / self.time_constant)
+
+
+class AutoScroller(QObject):
+    """Moves a scroll bar at ``speed`` pixels per second, one step per frame."""
+
+    state_changed = pyqtSignal(bool)    # running
+
+    def __init__(self, scroll_bar, speed=DEFAULT_SPEED, parent=None):
+        super().__init__(parent)
+        self.bar = scroll_bar
+        self.speed = speed
+        self.frames = 0
+        self.dropped_frames = 0
+        self._position = 0.0
+        self._clock = QElapsedTimer()
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.setInterval(FRAME_MS)
+        self._timer.timeout.connect(self._step)
+
+    def is_running(self):
+        return self._timer.isActive()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._position = float(self.bar.value())
+        self._clock.start()
+        self._timer.start()
+        self.state_changed.emit(True)
+
+    def stop(self):
+        if not self.is_running():
+            return
+        self._timer.stop()
+        self.state_changed.emit(False)
+
+    def toggle(self):
+        if self.is_running():
+            self.stop()
+        else:
+            self.start()
+
+    def set_speed(self, speed):
+        self.speed = min(MAX_SPEED, max(MIN_SPEED, speed))
+
+    def faster(self):
+        self.set_speed(self.speed * SPEED_STEP)
+
+    def slower(self):
+        self.set_speed(self.speed / SPEED_STEP)
+
+    def _step(self):
+        elapsed_ms = self._clock.restart()
+        self.frames += 1
+        if elapsed_ms > FRAME_MS * DROPPED_FRAME_RATIO:
+            self.dropped_frames += 1
+        if int(self._position) != self.bar.value():
+            # The reader scrolled by hand; continue from there.
+            self._position = float(self.bar.value())
+        self._position += self.speed * elapsed_ms / 1000.0
+        self.bar.setValue(int(self._position))
+        if self.bar.value() >= self.bar.maximum():
+            self.stop()
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+无界面的批量去白边工具。
+
+对一个或多个文件夹（可以是包含很多章节的漫画库根目录）执行和浏览器相同的
+外围白边裁剪与内部空白去除，用进程池占满所有 CPU 核心，把处理后的图片或
+每章拼接好的长条写入输出目录。拼接时还可以把上一页底部和下一页顶部的空白
+当作一整段空白压缩。
+
+    python imgviewer.py batch 漫画库 -o 输出目录
+    python imgviewer.py batch 漫画库 -o 输出目录 --stitch
+    python imgviewer.py batch 漫画库 -o 输出目录 --stitch --cross-page-gaps --keep-gap-height 40
+    python imgviewer.py batch 漫画库 --dry-run
+
+已完成的图片记录在输出目录的进度文件中，中断后重新运行会跳过它们。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import preprocess
+from library import is_image, natural_key
+
+PROGRESS_FILE = ".mangaviewer-batch.jsonl"
+
+# Outcome of processing one page in a worker process.
+#   rows_in / rows_out: image height before and after processing
+#   bytes_in / bytes_out: file size of the source and of the (would-be) output
+#   pixels: processed BGR array, only returned when stitching
+PageReport = namedtuple("PageReport", ["src", "dst", "rows_in", "rows_out", "bytes_in", "bytes_out", "pixels", "error"])
+
+Chapter = namedtuple("Chapter", ["folder", "rel", "pages"])
+
+
+def read_image(path):
+    """Decode an image file with OpenCV (works with non-ASCII paths on Windows)."""
+    data = np.fromfile(path, dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def encode_image(arr, ext, jpeg_quality=95):
+    params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if ext in ('.jpg', '.jpeg') else []
+    ok, buf = cv2.imencode(ext, arr, params)
+    if not ok:
+        raise ValueError(f"无法编码为 {ext}")
+    return buf
+
+
+def write_atomic(path, data):
+    """Write bytes to ``path`` through a temporary file so partial outputs never appear."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def find_chapters(roots):
+    """
+    Find every folder under ``roots`` that directly contains images.
+
+    The relative name of a chapter starts with the name of the root it was
+    found under, so several roots can share one output directory.
+    """
+    chapters = []
+    for root in roots:
+        root = os.path.abspath(root)
+        base = os.path.dirname(root)
+        for folder, dirs, files in os.walk(root):
+            dirs.sort(key=natural_key)
+            pages = sorted((f for f in files if is_image(f)), key=natural_key)
+            if pages:
+                chapters.append(Chapter(folder, os.path.relpath(folder, base),
+                                        [os.path.join(folder, f) for f in pages]))
+    return chapters
+
+
+def _init_worker():
+    # One OpenCV thread per process; the pool already uses every core.
+    cv2.setNumThreads(1)
+
+
+def process_page(src, dst, params, mode, jpeg_quality=95):
+    """
+    Process one page in a worker process.
+
+    :param mode: "write" to save the result to ``dst``, "dry" to only measure
+                 it, "stitch" to return the processed pixels
+    """
+    try:
+        bytes_in = os.path.getsize(src)
+        arr = read_image(src)
+        if arr is None:
+            raise ValueError("无法解码")
+        plan = preprocess.analyze(arr, **params)
+        out = preprocess.apply_plan(arr, plan)
+        bytes_out = 0
+        pixels = None
+        if mode == "stitch":
+            pixels = out
+        else:
+            buf = encode_image(out, os.path.splitext(dst)[1].lower(), jpeg_quality)
+            bytes_out = len(buf)
+            if mode == "write":
+                write_atomic(dst, buf.tobytes())
+        return PageReport(src, dst, arr.shape[0], plan.height, bytes_in, bytes_out, pixels, None)
+    except Exception as exc:
+        return PageReport(src, dst, 0, 0, 0, 0, None, str(exc))
+
+
+def stitch_pages(arrays, collapser=None):
+    """
+    Stack processed pages into one strip, scaling them to their median width.
+
+    :param collapser: optional preprocess.GapCollapser that the rows are streamed
+                      through, so white gaps spanning two pages are collapsed too
+    """
+    width = int(np.median([a.shape[1] for a in arrays]))
+    parts = []
+    for a in arrays:
+        if a.shape[1] != width:
+            height = max(1, int(a.shape[0] * width / a.shape[1]))
+            interp = cv2.INTER_AREA if a.shape[1] > width else cv2.INTER_CUBIC
+            a = cv2.resize(a, (width, height), interpolation=interp)
+        parts.extend(collapser.push(a) if collapser is not None else [a])
+    if collapser is not None:
+        parts.extend(collapser.finish())
+    if not parts:
+        return np.zeros((0, width, 3), dtype=np.uint8)
+    return np.concatenate(parts, axis=0)
+
+
+class Progress:
+    """Append-only record of finished outputs, used to resume an interrupted run."""
+
+    def __init__(self, output_dir, params):
+        self.path = os.path.join(output_dir, PROGRESS_FILE)
+        self.params = json.dumps(params, sort_keys=True)
+        self.done = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash.
+                    self.done[entry["output"]] = (entry["signature"], entry["params"])
+        self._file = None
+
+    @staticmethod
+    def signature(sources):
+        return [[os.path.getsize(p), os.stat(p).st_mtime_ns] for p in sources]
+
+    def is_done(self, output, sources):
+        entry = self.done.get(output)
+        return (entry is not None and entry == (self.signature(sources), self.params)
+                and os.path.exists(output))
+
+    def mark(self, output, sources):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"output": output, "signature": self.signature(sources),
+                                     "params": self.params}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class Stats:
+    """Running totals and throughput of a batch run."""
+
+    def __init__(self, total):
+        self.total = total
+        self.pages = 0
+        self.skipped = 0
+        self.failed = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.start = time.perf_counter()
+        self._last_report = 0.0
+
+    def add(self, report):
+        self.pages += 1
+        if report.error:
+            self.failed += 1
+            print(f"\n失败：{report.src}：{report.error}", file=sys.stderr)
+            return
+        self.rows_in += report.rows_in
+        self.rows_out += report.rows_out
+        self.bytes_in += report.bytes_in
+        self.bytes_out += report.bytes_out
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if force or now - self._last_report >= 1.0:
+            self._last_report = now
+            print(f"\r已处理 {self.pages + self.skipped}/{self.total} 页，{self.rate():.1f} 页/秒", end="", flush=True)
+
+    def summary(self, dry_run):
+        self.report(force=True)
+        print()
+        elapsed = time.perf_counter() - self.start
+        print(f"处理 {self.pages} 页（跳过已完成 {self.skipped} 页，失败 {self.failed} 页），"
+              f"用时 {elapsed:.1f} 秒，平均 {self.rate():.1f} 页/秒")
+        saved_rows = self.rows_in - self.rows_out
+        print(f"{'可去除' if dry_run else '已去除'} {saved_rows} 行"
+              f"（{100.0 * saved_rows / max(1, self.rows_in):.1f}%）")
+        if self.bytes_out:
+            saved = self.bytes_in - self.bytes_out
+            print(f"文件大小 {self.bytes_in / 2**20:.1f} MB -> {self.bytes_out / 2**20:.1f} MB，"
+                  f"{'可节省' if dry_run else '节省'} {saved / 2**20:.1f} MB")
+
+
+def run_pages(pool, chapters, args, params, progress, stats):
+    """Process every page independently and write one output file per page."""
+    mode = "dry" if args.dry_run else "write"
+    futures = []
+    for chapter in chapters:
+        for src in chapter.pages:
+            dst = os.path.join(args.output or "", chapter.rel, os.path.basename(src))
+            if progress is not None and progress.is_done(dst, [src]):
+                stats.skipped += 1
+                continue
+            futures.append(pool.submit(process_page, src, dst, params, mode, args.jpeg_quality))
+    for future in futures:
+        report = future.result()
+        stats.add(report)
+        if progress is not None and not report.error:
+            progress.mark(report.dst, [report.src])
+        stats.report()
+
+
+def run_stitch(pool, chapters, args, params, progress, stats):
+    """Process the pages of each chapter in parallel and write one stitched strip per chapter."""
+    mode = "stitch"
+    for chapter in chapters:
+        dst = os.path.join(args.output or "", chapter.rel + ".png")
+        if progress is not None and progress.is_done(dst, chapter.pages):
+            stats.skipped += len(chapter.pages)
+            continue
+        futures = [pool.submit(process_page, src, dst, params, mode) for src in chapter.pages]
+        arrays = []
+        for future in futures:
+            report = future.result()
+            stats.add(report)
+            if not report.error:
+                arrays.append(report.pixels)
+            stats.report()
+        if not arrays:
+            continue
+        collapser = None
+        if args.cross_page_gaps:
+            collapser = preprocess.GapCollapser(args.threshold, args.white_ratio,
+                                                args.min_gap_height, args.keep_gap_height)
+        strip = stitch_pages(arrays, collapser)
+        if collapser is not None:
+            stats.rows_out -= collapser.rows_in - collapser.rows_out
+        if not len(strip):
+            continue
+        buf = encode_image(strip, ".png")
+        stats.bytes_out += len(buf)
+        if not args.dry_run:
+            write_atomic(dst, buf.tobytes())
+            if progress is not None and len(arrays) == len(chapter.pages):
+                progress.mark(dst, chapter.pages)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="imgviewer.py batch", description="批量裁剪白边并去除内部空白（不打开窗口）")
+    parser.add_argument("inputs", nargs="+", help="章节文件夹或漫画库根目录")
+    parser.add_argument("-o", "--output", help="输出目录（--dry-run 时可省略）")
+    parser.add_argument("--stitch", action="store_true", help="每章拼接成一张 PNG 长条")
+    parser.add_argument("--dry-run", action="store_true", help="只统计可以节省的行数和字节数，不写文件")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="进程数（默认等于 CPU 核心数）")
+    parser.add_argument("--threshold", type=int, default=preprocess.DEFAULT_THRESHOLD)
+    parser.add_argument("--white-ratio", type=float, default=preprocess.DEFAULT_WHITE_RATIO)
+    parser.add_argument("--min-gap-height", type=int, default=preprocess.DEFAULT_MIN_GAP_HEIGHT)
+    parser.add_argument("--cross-page-gaps", action="store_true",
+                        help="拼接时把跨页的空白也当作一段空白压缩（需要 --stitch）")
+    parser.add_argument("--keep-gap-height", type=int, default=preprocess.DEFAULT_KEEP_GAP_HEIGHT,
+                        help="跨页空白压缩后保留的高度（像素，默认 0 即完全去除）")
+    parser.add_argument("--jpeg-quality", type=int, default=95)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.output and not args.dry_run:
+        print("需要指定输出目录 -o，或使用 --dry-run", file=sys.stderr)
+        return 2
+    params = dict(threshold=args.threshold, white_ratio=args.white_ratio, min_gap_height=args.min_gap_height)
+    if args.cross_page_gaps and not args.stitch:
+        print("--cross-page-gaps 需要和 --stitch 一起使用", file=sys.stderr)
+        return 2
+
+    chapters = find_chapters(args.inputs)
+    total = sum(len(c.pages) for c in chapters)
+    if not total:
+        print("没有找到图片文件。", file=sys.stderr)
+        return 1
+    print(f"{len(chapters)} 个文件夹，共 {total} 页，使用 {args.jobs} 个进程")
+
+    # Cross-page collapsing changes the stitched output, so it is part of the resume key.
+    resume_params = dict(params, keep_gap_height=args.keep_gap_height) if args.cross_page_gaps else params
+    progress = None if args.dry_run else Progress(args.output, resume_params)
+    stats = Stats(total)
+    pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker)
+    try:
+        if args.stitch:
+            run_stitch(pool, chapters, args, params, progress, stats)
+        else:
+            run_pages(pool, chapters, args, params, progress, stats)
+    except KeyboardInterrupt:
+        print("\n已中断，再次运行相同命令可以继续。", file=sys.stderr)
+        return 130
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if progress is not None:
+            progress.close()
+    stats.summary(args.dry_run)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+性能测试工具。
+
+    python -m bench micro                 # 各处理函数的微基准
+    python -m bench scroll                # 在 offscreen 平台上模拟滚动整章
+    python -m bench all -o result.json    # 全部运行并保存结果
+    python -m bench all --compare old.json
+
+测试用的图片由 bench.synth 按固定种子生成，每次运行完全相同。
+"""
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""python -m bench：运行性能测试，保存 JSON 结果并与之前的结果比较。"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+# The scroll simulation needs no display.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QT_VERSION_STR
+
+from bench import micro, scroll, synth
+
+REGRESSION_RATIO = 1.10  # Report metrics that got more than 10% worse
+
+
+def metadata():
+    return dict(
+        time=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        numpy=np.__version__,
+        opencv=cv2.__version__,
+        qt=QT_VERSION_STR,
+    )
+
+
+def flatten(data, prefix=""):
+    """Flatten nested dicts into {"a.b.c": value}."""
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def leaf(name):
+    return name.rsplit(".", 1)[-1]
+
+
+# Leaf names of the run settings and sample counts: inputs of a run, not
+# measurements. They are only reported when they differ.
+CONFIG_FIELDS = {"repeat", "pages", "page_size", "speed_px_s", "fps", "threads", "warm", "budget", "count",
+                 "file_bytes"}
+
+# Leaf names of the measurements where a larger value is better; every other
+# measurement (including dropped_frames and blank_frames) is "lower is better".
+HIGHER_IS_BETTER = {"hits", "frames"}
+
+
+def is_metric(name, value):
+    return (leaf(name) not in CONFIG_FIELDS and isinstance(value, (int, float))
+            and not isinstance(value, bool))
+
+
+def compare(old, new):
+    """Print every metric present in both results and flag regressions; changed settings are listed first."""
+    old_flat = flatten({k: v for k, v in old.items() if k != "meta"})
+    new_flat = flatten({k: v for k, v in new.items() if k != "meta"})
+    common = sorted(set(old_flat) & set(new_flat))
+    for name in common:
+        if leaf(name) in CONFIG_FIELDS and old_flat[name] != new_flat[name]:
+            print(f"{name:60s} {old_flat[name]!s:>12} {new_flat[name]!s:>12}  配置不同")
+    regressions = 0
+    for name in common:
+        a, b = old_flat[name], new_flat[name]
+        if not (is_metric(name, a) and is_metric(name, b)):
+            continue
+        ratio = b / a if a else (1.0 if b == a else float("inf"))
+        worse = ratio < 1 / REGRESSION_RATIO if leaf(name) in HIGHER_IS_BETTER else ratio > REGRESSION_RATIO
+        mark = "  <-- 变慢" if worse and a else ""
+        regressions += bool(mark)
+        print(f"{name:60s} {a:12.3f} {b:12.3f} {ratio:7.2f}x{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="MangaViewer 性能测试")
+    parser.add_argument("suite", choices=("micro", "scroll", "all"), nargs="?", default="all")
+    parser.add_argument("-o", "--output", help="把结果保存为 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果比较")
+    parser.add_argument("--repeat", type=int, default=5, help="微基准每项重复次数")
+    parser.add_argument("--pages", type=int, default=40, help="滚动模拟的页数")
+    parser.add_argument("--page-height", type=int, default=synth.DEFAULT_SPEC.height)
+    parser.add_argument("--speed", type=int, default=3000, help="滚动速度（像素/秒）")
+    parser.add_argument("--threads", type=int, default=0, help="后台线程数（0 = CPU 核心数）")
+    parser.add_argument("--warm", action="store_true", help="保留上次运行的磁盘缓存")
+    args = parser.parse_args(argv)
+
+    results = dict(meta=metadata())
+    if args.suite in ("micro", "all"):
+        results["micro"] = micro.run(repeat=args.repeat)
+        results["decode"] = micro.run_decode(repeat=args.repeat)
+    if args.suite in ("scroll", "all"):
+        spec = synth.DEFAULT_SPEC._replace(height=args.page_height)
+        results["scroll"] = scroll.run(pages=args.pages, spec=spec, speed=args.speed,
+                                       threads=args.threads, warm=args.warm)
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print()
+        return 1 if compare(old, results) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""各处理函数的微基准。"""
+import os
+import tempfile
+import time
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+import preprocess
+from bench import synth
+from bench.reference import cv_to_qimage, qimage_to_cv
+from imagecache import image_bytes
+from imgviewer import ImageViewer, remove_internal_white_gap
+from loader import decode_scale, read_image
+import qtimage
+from qtimage import process_qimage
+
+DEFAULT_SIZES = ((720, 4000), (720, 15000))
+SCAN_SPEC = synth.DEFAULT_SPEC._replace(width=2400, height=3600)  # A large scan for decode tests
+
+
+def timed(fn, repeat=5):
+    """Run ``fn`` ``repeat`` times and return timing statistics in milliseconds."""
+    fn()  # Warm up caches and lazy initialisation.
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples = np.array(samples)
+    return dict(min_ms=float(samples.min()), median_ms=float(np.median(samples)),
+                mean_ms=float(samples.mean()), repeat=repeat)
+
+
+def page_qimage(spec, seed=0):
+    """A synthetic page as the RGB32 QImage a decoded QPixmap would give."""
+    return cv_to_qimage(synth.make_page(spec, seed)).convertToFormat(QImage.Format_RGB32)
+
+
+def run(sizes=DEFAULT_SIZES, repeat=5):
+    """
+    Benchmark every processing stage on synthetic pages of the given sizes.
+
+    :return: {"<width>x<height>": {stage: stats, "bridge": pixel memory touched per page}}
+    """
+    results = {}
+    for width, height in sizes:
+        spec = synth.DEFAULT_SPEC._replace(width=width, height=height)
+        image = page_qimage(spec)
+        cv_img = qimage_to_cv(image)
+        cropped = ImageViewer.crop_white_border(None, image)
+        arr = synth.make_page(spec)
+        gray = arr[..., 0].copy()
+        stages = {
+            "qimage_to_cv": lambda: qimage_to_cv(image),
+            "cv_to_qimage": lambda: cv_to_qimage(cv_img),
+            "crop_white_border": lambda: ImageViewer.crop_white_border(None, image),
+            "remove_internal_white_gap": lambda: remove_internal_white_gap(cropped, min_gap_height=100),
+            "preprocess.analyze": lambda: preprocess.analyze(arr),
+            "preprocess.analyze_gray": lambda: preprocess.analyze(gray),
+            "process_qimage": lambda: process_qimage(image),
+        }
+        result = {name: timed(fn, repeat) for name, fn in stages.items()}
+        qtimage.stats.reset()
+        process_qimage(image)
+        result["bridge"] = qtimage.stats.snapshot()
+        results[f"{width}x{height}"] = result
+    return results
+
+
+def run_decode(spec=SCAN_SPEC, target_width=900, repeat=5):
+    """
+    Decode one JPEG at full resolution and at the reduced scale chosen for ``target_width``.
+
+    :return: {"scale_<n>": stats and decoded bytes}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        path = synth.write_chapter(folder, 1, spec)[0]
+        for scale in sorted({1, decode_scale(spec.width, target_width)}):
+            result = timed(lambda: read_image(path, scale), repeat)
+            result["decoded_bytes"] = image_bytes(read_image(path, scale))
+            results[f"scale_{scale}"] = result
+        results["file_bytes"] = os.path.getsize(path)
+    return results
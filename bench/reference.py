@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+旧版的逐像素 QImage/OpenCV 转换，只作为微基准的对照实现。
+
+查看器已改用 qtimage 中不复制像素的视图；这里保留原来的转换方式，用来衡量两者的差距。
+"""
+import cv2
+import numpy as np
+from PyQt5.QtGui import QImage
+
+
+def qimage_to_cv(qimage):
+    """Convert a QImage into an OpenCV (BGR) image."""
+    qimage = qimage.convertToFormat(QImage.Format_RGBA8888)
+    width = qimage.width()
+    height = qimage.height()
+    ptr = qimage.bits()
+    ptr.setsize(qimage.byteCount())
+    arr = np.array(ptr).reshape(height, width, 4)
+    # Convert RGBA to BGR
+    return cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR)
+
+
+def cv_to_qimage(cv_img):
+    """Convert an OpenCV (BGR) image to QImage."""
+    height, width, channel = cv_img.shape
+    bytesPerLine = 3 * width
+    # Convert BGR to RGB
+    rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
+    return QImage(rgb_image.data, width, height, bytesPerLine, QImage.Format_RGB888).copy()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+端到端滚动模拟。
+
+在 Qt 的 offscreen 平台上打开一个合成章节，以固定速度逐帧滚动到底，记录：
+每页从提交到处理完成的延迟、每页在视口中空白等待的时间、帧间隔以及峰值内存。
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PyQt5.QtCore import QEventLoop, QStandardPaths, QTimer
+
+from bench import synth
+
+
+def percentiles(values):
+    """p50/p90/p99/max of a list of numbers (all zero for an empty list)."""
+    if not values:
+        return dict(p50=0.0, p90=0.0, p99=0.0, max=0.0, count=0)
+    arr = np.asarray(values, dtype=np.float64)
+    p50, p90, p99 = np.percentile(arr, [50, 90, 99])
+    return dict(p50=float(p50), p90=float(p90), p99=float(p99), max=float(arr.max()), count=len(values))
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB, or None if it cannot be measured."""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes.
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / 2**20
+
+
+class ScrollRecorder:
+    """Collects per-page and per-frame timings from a running ImageViewer."""
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.requested = {}     # index -> time the page was first queued
+        self.ready = {}         # index -> time its first result arrived
+        self.blank_since = {}   # index -> time it was first seen on screen without pixels
+        self.visible_wait = {}  # index -> ms it stayed blank on screen
+        self.blank_frames = 0
+        self.frame_ms = []
+
+        loader = viewer.loader
+        request = loader.request
+
+        def recording_request(index, *args):
+            self.requested.setdefault(index, time.perf_counter())
+            return request(index, *args)
+
+        loader.request = recording_request
+        loader.page_ready.connect(lambda result: self.ready.setdefault(result.index, time.perf_counter()))
+
+    def has_pixels(self, idx, width):
+        cache = self.viewer.image_cache
+        if idx in self.viewer.failed_images:
+            return True
+        if idx in self.viewer.tall_pages:
+            return any(cache.any_scaled(idx, t) is not None for t in self.viewer.canvas.tiles_in_view(idx))
+        return cache.any_scaled(idx) is not None
+
+    def frame(self, interval_ms):
+        now = time.perf_counter()
+        self.frame_ms.append(interval_ms)
+        first, last = self.viewer.canvas.visible_pages()
+        width = self.viewer.canvas.display_width()
+        blank = False
+        for idx in range(first, last + 1):
+            if idx in self.visible_wait:
+                continue
+            if self.has_pixels(idx, width):
+                since = self.blank_since.get(idx, now)
+                self.visible_wait[idx] = (now - since) * 1000.0
+            else:
+                self.blank_since.setdefault(idx, now)
+                blank = True
+        if blank:
+            self.blank_frames += 1
+
+    def latencies_ms(self):
+        return [(self.ready[i] - t) * 1000.0 for i, t in self.requested.items() if i in self.ready]
+
+
+def run(pages=40, spec=synth.DEFAULT_SPEC, speed=3000, fps=60, threads=0, warm=False, timeout=300):
+    """
+    Scroll through a synthetic chapter and return the measurements.
+
+    :param speed: scroll speed in pixels per second
+    :param threads: worker threads (0 = one per core)
+    :param warm: keep the on-disk caches of a previous run instead of starting cold
+    """
+    from PyQt5.QtWidgets import QApplication
+    from imgviewer import ImageViewer
+    from progress import ProgressStore
+    from storage import cache_dir, data_dir
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    # Keep the benchmark's caches and reading progress out of the user's files.
+    QStandardPaths.setTestModeEnabled(True)
+    if not warm:
+        shutil.rmtree(cache_dir(), ignore_errors=True)
+    folder = os.path.join(tempfile.gettempdir(), "mangaviewer-bench-{}x{}-{}".format(spec.width, spec.height, pages))
+    if not os.path.isdir(folder) or len(os.listdir(folder)) != pages:
+        shutil.rmtree(folder, ignore_errors=True)
+        synth.write_chapter(folder, pages, spec)
+
+    # Always start at the first page.
+    progress = ProgressStore(os.path.join(data_dir(), "progress.sqlite3"))
+    progress.remove(folder)
+    progress.close()
+    start = time.perf_counter()
+    # Other benchmark chapters sit next to this one; measure only this chapter.
+    viewer = ImageViewer(folder, continue_chapters=False)
+    if threads > 0:
+        viewer.loader.pool.setMaxThreadCount(threads)
+    recorder = ScrollRecorder(viewer)
+    bar = viewer.canvas.verticalScrollBar()
+
+    loop = QEventLoop()
+    timer = QTimer()
+    timer.setInterval(int(1000 / fps))
+    state = dict(last=time.perf_counter(), position=0.0)
+
+    def tick():
+        now = time.perf_counter()
+        interval = now - state["last"]
+        state["last"] = now
+        recorder.frame(interval * 1000.0)
+        state["position"] += speed * interval
+        bar.setValue(int(state["position"]))
+        at_end = bar.value() >= bar.maximum() and len(recorder.visible_wait) >= viewer.canvas.visible_pages()[1] + 1
+        if at_end or now - start > timeout:
+            loop.quit()
+
+    timer.timeout.connect(tick)
+    timer.start()
+    loop.exec_()
+    timer.stop()
+    elapsed = time.perf_counter() - start
+
+    target_ms = 1000.0 / fps
+    result = dict(
+        pages=pages,
+        page_size=[spec.width, spec.height],
+        speed_px_s=speed,
+        fps=fps,
+        threads=viewer.loader.thread_count(),
+        warm=warm,
+        elapsed_s=elapsed,
+        frames=len(recorder.frame_ms),
+        frame_ms=percentiles(recorder.frame_ms[1:]),
+        dropped_frames=sum(1 for ms in recorder.frame_ms[1:] if ms > 1.5 * target_ms),
+        blank_frames=recorder.blank_frames,
+        page_latency_ms=percentiles(recorder.latencies_ms()),
+        visible_wait_ms=percentiles(list(recorder.visible_wait.values())),
+        cache=viewer.image_cache.stats(),
+        peak_memory_mb=peak_memory_mb(),
+    )
+    viewer.close()
+    app.processEvents()
+    return result
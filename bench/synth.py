@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""按固定种子生成韩漫风格的测试图片：白边、若干画格和画格之间的空白。"""
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Layout of a synthetic page.
+#   border: white margin around the content (top/bottom and left/right)
+#   panel_min / panel_max: panel height range
+#   gap_min / gap_max: height range of the white gaps between panels
+PageSpec = namedtuple("PageSpec", ["width", "height", "border", "panel_min", "panel_max", "gap_min", "gap_max"])
+
+DEFAULT_SPEC = PageSpec(720, 4000, 40, 300, 900, 60, 500)
+TALL_SPEC = PageSpec(800, 60000, 60, 500, 1500, 50, 600)
+
+
+def make_page(spec=DEFAULT_SPEC, seed=0):
+    """
+    Return one (height, width, 3) BGR page.
+
+    Panels are filled with a gradient plus a little noise so encoders and the
+    white detection see realistic, non-uniform content.
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((spec.height, spec.width, 3), 255, dtype=np.uint8)
+    x0, x1 = spec.border, spec.width - spec.border
+    y = spec.border
+    bottom = spec.height - spec.border
+    while y < bottom:
+        height = min(int(rng.integers(spec.panel_min, spec.panel_max + 1)), bottom - y)
+        color = rng.integers(0, 200, 3)
+        ramp = np.linspace(0, 55, height, dtype=np.float32)[:, None, None]
+        panel = np.clip(color[None, None, :] + ramp + rng.normal(0, 6, (height, x1 - x0, 3)), 0, 230)
+        page[y:y + height, x0:x1] = panel.astype(np.uint8)
+        y += height + int(rng.integers(spec.gap_min, spec.gap_max + 1))
+    return page
+
+
+def write_chapter(folder, count, spec=DEFAULT_SPEC, seed=0, ext=".jpg"):
+    """
+    Write ``count`` pages named 001.jpg, 002.jpg, ... into ``folder``.
+
+    :return: list of the written paths
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, "{:03d}{}".format(i + 1, ext))
+        ok, buf = cv2.imencode(ext, make_page(spec, seed + i))
+        if not ok:
+            raise ValueError(f"无法编码为 {ext}")
+        buf.tofile(path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+虚拟化的连续滚动画布。
+
+整章图片被看作一条虚拟长条，每页的显示高度保存在前缀和索引中，滚动条覆盖
+整章的高度。绘制时只画视口内可见的那一段，跳页只需要查一次偏移量。
+上一页底部和下一页顶部的空白按一段空白处理，压缩后多出的行在绘制时裁掉。
+"""
+import numpy as np
+from PyQt5.QtCore import Qt, QRect, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter
+from PyQt5.QtWidgets import QAbstractScrollArea
+
+import perftrace
+import tiles
+from preprocess import seam_trims
+
+# Aspect ratio (height / width) assumed for pages whose size is not known yet.
+DEFAULT_PAGE_RATIO = 1.5
+
+
+def display_height(width, height, display_width):
+    """Height of a width x height page scaled to ``display_width`` (same rounding as scale_to_width)."""
+    if width <= 0 or height <= 0:
+        return 0
+    return max(1, int(height * display_width / width))
+
+
+class HeightIndex:
+    """
+    Prefix sums of page heights at the current display width.
+
+    Page sizes are kept at source resolution so a width change only needs one
+    vectorised rebuild. Offsets are recomputed lazily after updates, so lookups
+    are O(1) (``offset``) or O(log n) (``page_at``).
+
+    With ``seam_gap`` set to (min_gap_height, keep_height), both in
+    full-resolution source rows like the in-page gap rule, the white tail and
+    head of neighbouring pages are collapsed like one gap (see
+    preprocess.seam_trims); a page's height is then what remains of it after
+    the hidden rows at its top and bottom (``trim``) are taken off.
+    """
+
+    def __init__(self):
+        self.width = 1
+        self.ratio = DEFAULT_PAGE_RATIO
+        self.seam_gap = None
+        # (w, h, white head, white tail, decode scale) of the processed page, w = 0: unknown
+        self._sizes = np.zeros((0, 5), dtype=np.int64)
+        self._full = np.zeros(0, dtype=np.int64)          # display heights of the whole pages
+        self._trims = np.zeros((0, 2), dtype=np.int64)    # display rows hidden at the top and bottom
+        self._heights = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._heights)
+
+    def reset(self, count, sizes=None):
+        """
+        Start a new strip of ``count`` pages.
+
+        :param sizes: optional {index: (width, height[, head, tail, scale])} of pages known in advance
+        """
+        self._sizes = self._new_sizes(count, sizes)
+        known = self._sizes[self._sizes[:, 0] > 0]
+        self.ratio = float(np.median(known[:, 1] / known[:, 0])) if len(known) else DEFAULT_PAGE_RATIO
+        self._rebuild_heights()
+
+    def extend(self, count, sizes=None):
+        """
+        Append ``count`` pages after the last one.
+
+        :param sizes: optional {index among the new pages: (width, height[, head, tail, scale])}
+        """
+        self._sizes = np.concatenate((self._sizes, self._new_sizes(count, sizes)))
+        self._rebuild_heights()
+
+    @staticmethod
+    def _new_sizes(count, sizes):
+        new = np.zeros((count, 5), dtype=np.int64)
+        new[:, 4] = 1
+        for i, size in (sizes or {}).items():
+            new[i, :len(size)] = size
+        return new
+
+    def set_width(self, width):
+        if width != self.width:
+            self.width = max(1, width)
+            self._rebuild_heights()
+
+    def set_seam_gap(self, seam_gap):
+        self.seam_gap = seam_gap
+        self._rebuild_heights()
+
+    def _rebuild_heights(self):
+        w = self._sizes[:, 0]
+        h = self._sizes[:, 1]
+        known = w > 0
+        heights = np.full(len(w), int(self.width * self.ratio), dtype=np.int64)
+        heights[known] = np.maximum(1, (h[known] * self.width / w[known]).astype(np.int64))
+        heights[known & (h == 0)] = 0
+        self._full = heights
+        self._trims = np.zeros((len(w), 2), dtype=np.int64)
+        if self.seam_gap is not None and len(w) > 1:
+            self._trims[:] = self._seam_trims(0, len(w))
+        self._heights = heights - self._trims.sum(axis=1)
+        self._dirty = True
+
+    def _seam_trims(self, lo, hi):
+        """Display rows hidden at the top and bottom of pages lo..hi-1 when their seams are collapsed."""
+        sizes = self._sizes[lo:hi]
+        # Gaps are measured in full-resolution source rows; unknown pages break seams.
+        edges = [(int(h * s), int(head * s), int(tail * s)) if w > 0 else (1, 0, 0)
+                 for w, h, head, tail, s in sizes]
+        trims = np.array(seam_trims(edges, *self.seam_gap), dtype=np.int64)
+        rows_per_source_row = self.width / (np.maximum(1, sizes[:, 0]) * sizes[:, 4])
+        trims = (trims * rows_per_source_row[:, None]).astype(np.int64)
+        return np.minimum(trims, self._full[lo:hi, None])
+
+    def _is_white(self, i):
+        w, h, head = self._sizes[i, :3]
+        return w > 0 and head >= h
+
+    def _update_seams(self, i):
+        """Recompute the trims of the seams above and below page i."""
+        last = len(self._heights) - 1
+        if self.seam_gap is None or last < 1:
+            return
+        a = max(0, i - 1)
+        while a > 0 and self._is_white(a):
+            a -= 1
+        b = min(last, i + 1)
+        while b < last and self._is_white(b):
+            b += 1
+        trims = self._seam_trims(a, b + 1)
+        # The top of page a and the bottom of page b belong to other seams.
+        trims[0, 0] = self._trims[a, 0]
+        trims[-1, 1] = self._trims[b, 1]
+        self._trims[a:b + 1] = trims
+
+    def is_known(self, i):
+        return self._sizes[i, 0] > 0
+
+    def size(self, i):
+        """Source (width, height) of page i, or None if unknown."""
+        w, h = self._sizes[i, :2]
+        return (int(w), int(h)) if w > 0 else None
+
+    def set_size(self, i, width, height, head=0, tail=0, scale=1):
+        """
+        Record the real size and white edges of page i.
+
+        A page that failed to load can be given a height of 0.
+        :param scale: reduction factor the page was decoded (and measured) at
+        :return: True if the display height of any page changed
+        """
+        self._sizes[i] = (max(1, width), height, head, tail, max(1, scale))
+        self._full[i] = display_height(width, height, self.width) if height > 0 else 0
+        self._update_seams(i)
+        heights = self._full - self._trims.sum(axis=1)
+        if np.array_equal(heights, self._heights):
+            return False
+        self._heights = heights
+        self._dirty = True
+        return True
+
+    def _ensure(self):
+        if self._dirty:
+            self._offsets = np.concatenate(([0], np.cumsum(self._heights)))
+            self._dirty = False
+
+    def height(self, i):
+        return int(self._heights[i])
+
+    def full_height(self, i):
+        """Display height of page i before its seams are collapsed."""
+        return int(self._full[i])
+
+    def trim(self, i):
+        """Display rows (top, bottom) of page i hidden by collapsed seams."""
+        top, bottom = self._trims[i]
+        return int(top), int(bottom)
+
+    def offset(self, i):
+        self._ensure()
+        return int(self._offsets[i])
+
+    @property
+    def total(self):
+        self._ensure()
+        return int(self._offsets[-1])
+
+    def page_at(self, y):
+        """Index of the page that contains virtual row y."""
+        self._ensure()
+        i = int(np.searchsorted(self._offsets, y, side="right")) - 1
+        return min(max(i, 0), len(self._heights) - 1)
+
+
+class PageCanvas(QAbstractScrollArea):
+    """
+    Scrolling widget that paints only the visible slice of the virtual strip.
+
+    Pixmaps come from ``pixmap_provider(page, width, tile)``, normally a cache lookup
+    done by the owner; pages without a pixmap are drawn as placeholders of the
+    expected height, labelled with ``page_label(page)``, so the scroll bar never
+    jumps when they arrive.
+    """
+
+    visible_changed = pyqtSignal()      # scroll position or viewport size changed
+    width_changed = pyqtSignal(int)     # new display width
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.index = HeightIndex()
+        self.pixmap_provider = lambda page, width, tile: None
+        self.page_label = lambda page: str(page + 1)
+        self.background = QColor(30, 30, 30)
+        # Page tiles painted as placeholders because their pixmap was not ready.
+        self.misses = 0
+        self._missing = set()
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.viewport().setAttribute(Qt.WA_OpaquePaintEvent)
+        self.verticalScrollBar().setSingleStep(40)
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+
+    # ----- strip layout -----
+
+    def page_count(self):
+        return len(self.index)
+
+    def display_width(self):
+        return max(1, self.viewport().width())
+
+    def set_pages(self, count, sizes=None):
+        """Replace the strip with ``count`` pages; see HeightIndex.reset."""
+        self.index.set_width(self.display_width())
+        self.index.reset(count, sizes)
+        self._missing.clear()
+        self._update_range()
+        self.verticalScrollBar().setValue(0)
+        self.viewport().update()
+
+    def append_pages(self, count, sizes=None):
+        """Extend the strip with ``count`` pages; the scroll position does not move."""
+        self.index.extend(count, sizes)
+        self._update_range()
+        self.viewport().update()
+
+    @perftrace.traced("relayout")
+    def set_page_size(self, i, width, height, head=0, tail=0, scale=1):
+        """Record the real size and white edges of page i, keeping the content under the viewport still."""
+        value = self.verticalScrollBar().value()
+        top = self.index.page_at(value)
+        # Position inside the whole top page, hidden rows included.
+        inner = value - self.index.offset(top) + self.index.trim(top)[0]
+        old_full = self.index.full_height(top)
+        if not self.index.set_size(i, width, height, head, tail, scale):
+            return
+        if i == top and old_full:
+            inner = inner * self.index.full_height(top) // old_full
+        value = self.index.offset(top) + max(0, inner - self.index.trim(top)[0])
+        self._update_range()
+        self.verticalScrollBar().setValue(value)
+        self.viewport().update()
+
+    def page_offset(self, i):
+        return self.index.offset(i)
+
+    def page_at(self, y):
+        return self.index.page_at(y)
+
+    def scroll_position(self):
+        """Return (page, offset in display pixels) of the viewport top edge."""
+        value = self.verticalScrollBar().value()
+        page = self.index.page_at(value)
+        return page, value - self.index.offset(page)
+
+    def scroll_to_page(self, i, offset=0):
+        self.verticalScrollBar().setValue(self.index.offset(i) + offset)
+
+    def visible_pages(self):
+        """Return (first, last) indices of the pages intersecting the viewport."""
+        if not len(self.index):
+            return 0, -1
+        value = self.verticalScrollBar().value()
+        first = self.index.page_at(value)
+        last = self.index.page_at(value + max(0, self.viewport().height() - 1))
+        return first, last
+
+    def center_page(self):
+        return self.index.page_at(self.verticalScrollBar().value() + self.viewport().height() // 2)
+
+    # ----- pixmaps -----
+
+    def update_page(self, i):
+        """Repaint page i if it is on screen (call after its pixmap changed)."""
+        if self._is_visible(i):
+            self.viewport().update()
+
+    def _is_visible(self, i):
+        first, last = self.visible_pages()
+        return first <= i <= last
+
+    # ----- Qt events -----
+
+    def _update_range(self):
+        bar = self.verticalScrollBar()
+        bar.setPageStep(self.viewport().height())
+        bar.setRange(0, max(0, self.index.total - self.viewport().height()))
+
+    def _on_scroll(self, value):
+        self.viewport().update()
+        self.visible_changed.emit()
+
+    @perftrace.traced("resize")
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        width = self.display_width()
+        if width != self.index.width and len(self.index):
+            # Keep the same relative position inside the top page.
+            page, inner = self.scroll_position()
+            fraction = inner / self.index.height(page) if self.index.height(page) else 0
+            self.index.set_width(width)
+            self._update_range()
+            self.verticalScrollBar().setValue(
+                self.index.offset(page) + int(fraction * self.index.height(page)))
+            self.width_changed.emit(width)
+        else:
+            self.index.set_width(width)
+            self._update_range()
+        self.visible_changed.emit()
+
+    @perftrace.traced("paint")
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        rect = event.rect()
+        value = self.verticalScrollBar().value()
+        width = self.display_width()
+        bottom = value + rect.bottom() + 1
+        y = rect.top()
+        if len(self.index):
+            i = self.index.page_at(value + rect.top())
+            while i < len(self.index) and self.index.offset(i) < bottom:
+                top = self.index.offset(i) - value
+                height = self.index.height(i)
+                if height:
+                    self._paint_page(painter, i, QRect(0, top, width, height))
+                y = top + height
+                i += 1
+        if y <= rect.bottom():
+            painter.fillRect(QRect(rect.left(), y, rect.width(), rect.bottom() + 1 - y), self.background)
+        painter.end()
+
+    def page_tiles(self, i):
+        """Return [(tile, a, b), ...] display bands of page i relative to its top."""
+        size = self.index.size(i)
+        if size is None or not size[1]:
+            return [(0, 0, self.index.height(i))]
+        return tiles.tile_bands(size[0], size[1], self.display_width())
+
+    def tiles_in_view(self, i, margin=0):
+        """Tiles of page i whose bands intersect the viewport extended by ``margin`` pixels."""
+        value = self.verticalScrollBar().value()
+        top = self.index.offset(i) - self.index.trim(i)[0] - value
+        return [t for t, a, b in self.page_tiles(i)
+                if top + b > -margin and top + a < self.viewport().height() + margin]
+
+    def _paint_page(self, painter, i, target):
+        visible = self.viewport().rect().intersected(target)
+        # Tiles are laid out on the whole page; rows hidden by a collapsed seam are clipped.
+        top = target.top() - self.index.trim(i)[0]
+        clip = target.height() != self.index.full_height(i)
+        if clip:
+            painter.setClipRect(visible)
+        for tile, a, b in self.page_tiles(i):
+            band = QRect(0, top + a, target.width(), b - a)
+            if band.intersects(visible):
+                self._paint_tile(painter, i, tile, band)
+        if clip:
+            painter.setClipping(False)
+
+    def _paint_tile(self, painter, i, tile, target):
+        pixmap = self.pixmap_provider(i, target.width(), tile)
+        if pixmap is None or pixmap.isNull():
+            if (i, tile) not in self._missing:
+                self._missing.add((i, tile))
+                self.misses += 1
+            painter.fillRect(target, self.background)
+            painter.setPen(QColor(120, 120, 120))
+            visible = target.intersected(self.viewport().rect())
+            painter.drawText(visible, Qt.AlignCenter, self.page_label(i))
+            return
+        self._missing.discard((i, tile))
+        if pixmap.width() == target.width() and pixmap.height() == target.height():
+            painter.drawPixmap(target.topLeft(), pixmap)
+        else:
+            # Pixmap made for another width: stretch it until the rescaled one arrives.
+            painter.drawPixmap(target, pixmap)
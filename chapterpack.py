@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+章节包：整章处理好的像素，按显示宽度逐行存放的文件。
+
+第一次阅读某一章时，后台线程把每页解码、去白边并缩放到当前显示宽度，依次写入
+一个 RGB888 原始像素文件，文件末尾是各页起始行、行数和处理后尺寸的偏移表。
+之后打开同一章、同一宽度时直接用 np.memmap 映射该文件，显示某页（或长条图片的
+某一块）只需切出对应的行放进 QImage，不再解码和分析。源图片的列表、大小或修改
+时间有任何变化，章节包即失效并在后台重建。
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+import perftrace
+from loader import process_page, scale_to_width
+from plancache import file_signature
+from qtimage import qimage_view, rgb_view
+from tiles import trim_directory
+
+log = logging.getLogger(__name__)
+
+PACK_MAGIC = b"MVPACK03"
+CHANNELS = 3            # Rows are stored as RGB888
+DEFAULT_PACK_MB = 8192
+
+# The offset table is stored as JSON after the pixel rows; the last bytes of
+# the file give its position and length.
+_FOOTER = struct.Struct("<QQ8s")
+
+
+def source_signature(paths):
+    """Digest of the page list and the size and mtime of every page."""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            size, mtime = file_signature(path)
+        except OSError:
+            size, mtime = -1, -1
+        digest.update("{}|{}|{}\n".format(path, size, mtime).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ChapterPack:
+    """
+    A read-only, memory-mapped chapter pack.
+
+    ``pages`` holds (first row, rows, processed width, processed height, white
+    head, white tail, decode scale) per page; a page that could not be decoded
+    has 0 rows and height 0.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            f.seek(-_FOOTER.size, os.SEEK_END)
+            table_offset, table_length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != PACK_MAGIC:
+                raise ValueError("not a chapter pack: " + path)
+            f.seek(table_offset)
+            table = json.loads(f.read(table_length).decode("utf-8"))
+        self.width = table["width"]
+        self.signature = table["signature"]
+        self.pages = [tuple(page) for page in table["pages"]]
+        total = table_offset // (self.width * CHANNELS)
+        self.rows = np.memmap(path, dtype=np.uint8, mode="r", shape=(total, self.width, CHANNELS)) if total else None
+
+    def __len__(self):
+        return len(self.pages)
+
+    def sizes(self):
+        """{index: (width, height, head, tail, scale)} of every page, as processed."""
+        return {i: (max(1, w), h, head, tail, scale) for i, (_, _, w, h, head, tail, scale) in enumerate(self.pages)}
+
+    def page_rows(self, i, a=0, b=None):
+        """Display rows [a, b) of page i as an (h, width, 3) view into the file."""
+        start, rows = self.pages[i][:2]
+        b = rows if b is None else min(b, rows)
+        return self.rows[start + a:start + b]
+
+    def close(self):
+        self.rows = None
+
+
+class PackWriter:
+    """Appends processed pages to a new pack file, which appears only when ``finish`` is called."""
+
+    def __init__(self, path, width):
+        self.path = path
+        self.width = width
+        self.pages = []
+        self._rows = 0
+        self._tmp = "{}.{}.tmp".format(path, threading.get_ident())
+        self._file = open(self._tmp, "wb")
+
+    def add(self, rows, width, height, head=0, tail=0, scale=1):
+        """
+        Append one page.
+
+        :param rows: contiguous (h, self.width, 3) RGB rows at display width, or None for a failed page
+        :param width, height: the page's processed size
+        :param head, tail: white rows at the top and bottom of the processed page
+        :param scale: decode reduction factor the page was processed at
+        """
+        count = 0 if rows is None else len(rows)
+        if count:
+            self._file.write(rows.data)
+        self.pages.append((self._rows, count, width, height, head, tail, scale))
+        self._rows += count
+
+    def finish(self, signature):
+        table = json.dumps(dict(width=self.width, signature=signature, pages=self.pages),
+                           separators=(",", ":")).encode("utf-8")
+        offset = self._rows * self.width * CHANNELS
+        self._file.write(table)
+        self._file.write(_FOOTER.pack(offset, len(table), PACK_MAGIC))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+class PackStore:
+    """
+    Chapter pack files, one per (chapter, display width, preprocessing parameters).
+
+    Like TileStore, the total size is capped and the least recently used
+    files are deleted first.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_PACK_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def file(self, folder, width, params):
+        text = "{}|{}".format(os.path.abspath(folder), sorted(params.items()))
+        return os.path.join(self.directory, "{}_w{}.pack".format(
+            hashlib.sha1(text.encode("utf-8")).hexdigest(), width))
+
+    def open(self, folder, paths, width, params):
+        """
+        Return the ChapterPack of ``folder`` at ``width``, or None if there is none.
+
+        A pack built from other files than ``paths`` (in size or mtime) is deleted.
+        """
+        path = self.file(folder, width, params)
+        try:
+            pack = ChapterPack(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        if pack.signature != source_signature(paths) or len(pack) != len(paths):
+            pack.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)  # Mark as recently used.
+        except OSError:
+            pass
+        return pack
+
+    def trim(self, keep):
+        with self._lock:
+            trim_directory(self.directory, ".pack", self.max_bytes, keep=keep)
+
+
+class PackJob(QRunnable):
+    """Decode, process and scale every page of a chapter into a new pack file."""
+
+    def __init__(self, builder, folder, paths, width, target_width):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.builder = builder
+        self.folder = folder
+        self.paths = list(paths)
+        self.width = width
+        self.target_width = target_width  # Device pixels needed; 0 decodes at full resolution
+        self.params = dict(builder.params)
+        self.cache = builder.cache
+        self.cancelled = False
+
+    def run(self):
+        done = False
+        try:
+            with perftrace.span("PackJob", pages=len(self.paths), width=self.width):
+                done = self.build()
+        except Exception as exc:  # Never let an exception escape into Qt.
+            log.warning("生成章节包失败 %s: %s", self.folder, exc)
+        self.builder._job_done.emit(self, done)
+
+    def build(self):
+        store = self.builder.store
+        path = store.file(self.folder, self.width, self.params)
+        signature = source_signature(self.paths)
+        writer = PackWriter(path, self.width)
+        try:
+            for page in self.paths:
+                if self.cancelled:
+                    writer.abort()
+                    return False
+                rows, size = self.process(page)
+                writer.add(rows, *size)
+            writer.finish(signature)
+        except BaseException:
+            writer.abort()
+            raise
+        store.trim(keep=path)
+        return True
+
+    def process(self, path):
+        """Processed rows of one page at the pack width, and its processed size, white edges and decode scale."""
+        try:
+            result = process_page(path, self.params, self.target_width, self.cache)
+        except (OSError, KeyError):
+            result = None
+        if result is None:
+            return None, (1, 0)
+        processed, plan, scale = result
+        scaled = scale_to_width(processed, self.width)
+        scaled_arr, scaled_image = qimage_view(scaled)
+        rgb = rgb_view(scaled_arr, scaled_image.format())
+        # Copy while the QImage owning the pixels is still alive.
+        rows = np.ascontiguousarray(np.broadcast_to(rgb, rgb.shape[:2] + (CHANNELS,)))
+        return rows, (plan.width, plan.height, plan.head, plan.tail, scale)
+
+
+class PackBuilder(QObject):
+    """
+    Builds chapter packs one at a time on a single background thread.
+
+    Starting a build for another chapter or width cancels the running one.
+    """
+
+    pack_ready = pyqtSignal(str, int)   # folder, width
+
+    _job_done = pyqtSignal(object, bool)
+
+    def __init__(self, store, cache=None, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.cache = cache  # optional PlanCache shared with the page loader
+        self.params = {}
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._job = None
+        self._job_done.connect(self._on_job_done)
+
+    def is_building(self, folder, width):
+        job = self._job
+        return job is not None and not job.cancelled and (job.folder, job.width) == (folder, width)
+
+    def build(self, folder, paths, width, target_width=0):
+        if self.is_building(folder, width):
+            return
+        self.cancel()
+        self._job = PackJob(self, folder, paths, width, target_width)
+        self.pool.start(self._job)
+
+    def cancel(self):
+        if self._job is not None:
+            self._job.cancelled = True
+            self._job = None
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.waitForDone()
+
+    def _on_job_done(self, job, done):
+        if job is self._job:
+            self._job = None
+        if done and not job.cancelled:
+            self.pack_ready.emit(job.folder, job.width)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+按内存预算管理的图片缓存。
+
+分两层：处理后的全分辨率原图（QImage）和按视口宽度缩放后的显示图（QPixmap）。
+每层各自按最近最少使用淘汰；显示图被淘汰后可以直接从原图重新缩放，
+只有两层都没有时才需要重新解码。
+"""
+from collections import OrderedDict
+
+DEFAULT_BUDGET_MB = 512
+ORIGINAL_SHARE = 0.6  # Fraction of the budget given to processed originals
+
+
+def image_bytes(image):
+    """Approximate memory used by a QImage or QPixmap."""
+    if image is None or image.isNull():
+        return 0
+    return image.width() * image.height() * max(1, image.depth()) // 8
+
+
+class LruTier:
+    """A byte-limited LRU mapping with hit/miss statistics."""
+
+    def __init__(self, name, budget, on_evict=None):
+        self.name = name
+        self.budget = budget
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._items = OrderedDict()  # key -> (value, nbytes)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def peek(self, key):
+        """Return the value without touching the LRU order or the statistics."""
+        item = self._items.get(key)
+        return item[0] if item is not None else None
+
+    def put(self, key, value, nbytes):
+        self.discard(key)
+        self._items[key] = (value, nbytes)
+        self.bytes += nbytes
+        # Never evict the entry that was just added, even if it alone exceeds the budget.
+        while self.bytes > self.budget and len(self._items) > 1:
+            old_key, (_, old_bytes) = self._items.popitem(last=False)
+            self.bytes -= old_bytes
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key)
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+            return True
+        return False
+
+    def keys(self):
+        return list(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return dict(entries=len(self._items), bytes=self.bytes, budget=self.budget,
+                    hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+class PageImageCache:
+    """
+    Two-tier page cache sharing one memory budget.
+
+    ``originals`` maps (page, tile) to a processed full-resolution QImage;
+    ``scaled`` maps (page, tile, width) to a display-ready QPixmap. Pages that
+    are not tiled use tile 0 for the whole page.
+    """
+
+    def __init__(self, budget_mb=DEFAULT_BUDGET_MB):
+        self._widths = {}  # (page, tile) -> set of widths present in the scaled tier
+        self.originals = LruTier("originals", 0)
+        self.scaled = LruTier("scaled", 0, on_evict=self._forget_width)
+        self.set_budget(budget_mb)
+
+    def set_budget(self, budget_mb):
+        total = int(budget_mb * 1024 * 1024)
+        self.originals.budget = int(total * ORIGINAL_SHARE)
+        self.scaled.budget = total - self.originals.budget
+
+    def _forget_width(self, key):
+        page, tile, width = key
+        widths = self._widths.get((page, tile))
+        if widths is not None:
+            widths.discard(width)
+            if not widths:
+                del self._widths[(page, tile)]
+
+    # ----- processed originals -----
+
+    def get_original(self, page, tile=0):
+        return self.originals.get((page, tile))
+
+    def has_original(self, page, tile=0):
+        return (page, tile) in self.originals
+
+    def put_original(self, page, image, tile=0):
+        self.originals.put((page, tile), image, image_bytes(image))
+
+    # ----- display pixmaps -----
+
+    def get_scaled(self, page, width, tile=0):
+        return self.scaled.get((page, tile, width))
+
+    def has_scaled(self, page, width, tile=0):
+        return (page, tile, width) in self.scaled
+
+    def put_scaled(self, page, width, pixmap, tile=0):
+        self.scaled.put((page, tile, width), pixmap, image_bytes(pixmap))
+        self._widths.setdefault((page, tile), set()).add(width)
+
+    def any_scaled(self, page, tile=0):
+        """Return a pixmap of ``page`` at any cached width (for stretching while rescaling)."""
+        for width in self._widths.get((page, tile), ()):
+            return self.scaled.peek((page, tile, width))
+        return None
+
+    def discard_page(self, page):
+        """Drop every tier entry of ``page``, all tiles included."""
+        for key in self.originals.keys():
+            if key[0] == page:
+                self.originals.discard(key)
+        for key in [k for k in self._widths if k[0] == page]:
+            for width in self._widths.pop(key):
+                self.scaled.discard(key + (width,))
+
+    def clear(self):
+        self.originals.clear()
+        self.scaled.clear()
+        self._widths.clear()
+
+    def resident_bytes(self):
+        return self.originals.bytes + self.scaled.bytes
+
+    def stats(self):
+        """Hit/miss counts and resident bytes of both tiers."""
+        return dict(originals=self.originals.stats(), scaled=self.scaled.stats(),
+                    resident_bytes=self.resident_bytes())
@@ -1,27 +1,55 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import cv2
-import numpy as np
-from PyQt5.QtGui import QImage
 
+import bisect
+import logging
 import os
+import sqlite3
 import sys
-from PyQt5.QtCore import Qt, QSettings, QRect
-from PyQt5.QtGui import QPixmap, QWheelEvent
+import time
+import zipfile
+from collections import namedtuple
+from PyQt5.QtCore import Qt, QSettings, QRect, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
-    QWidget,
-    QScrollArea,
-    QVBoxLayout,
-    QLabel,
     QFileDialog,
     QMessageBox,
     QInputDialog,
 )
 
+import archive
+import perftrace
+import preprocess
+from autoscroll import DEFAULT_SPEED, AutoScroller, ScrollVelocity
+from canvas import PageCanvas, display_height
+from chapterpack import DEFAULT_PACK_MB, PackBuilder, PackStore
+from imagecache import DEFAULT_BUDGET_MB, PageImageCache
+from library import LibraryIndex
+from loader import DECODE_SCALES, PageLoader
+from minimap import Minimap
+from perfoverlay import PerfOverlay
+from plancache import DEFAULT_MAX_ENTRIES, PlanCache, file_signature
+from progress import ProgressStore
+import qtimage
+from qtimage import qimage_view, render_plan, rgb_to_qimage
+from storage import cache_dir, data_dir
+from thumbnails import ThumbnailBuilder
+from tiles import DEFAULT_SPILL_MB, TileStore, display_band, tile_count
+
+log = logging.getLogger(__name__)
+
+# A chapter (folder or archive) in the strip: its pages are image_files[start:start + count].
+Chapter = namedtuple("Chapter", ["folder", "start", "count"])
+
 class ImageViewer(QMainWindow):
-    def __init__(self, folder=None):
+    # Background search for the chapter after ``after``: (after, next folder or "", pages, known sizes)
+    chapter_scanned = pyqtSignal(str, str, object, object)
+    # Background opening of a chapter pack: (request number, ChapterPack or None)
+    pack_opened = pyqtSignal(int, object)
+
+    def __init__(self, folder=None, continue_chapters=None):
         super().__init__()
 
         self.setWindowTitle("无缝滚动图片浏览器")
@@ -30,22 +58,156 @@ class ImageViewer(QMainWindow):
 
         # Initialize data
         self.image_files = []       # List of all image file paths
-        self.current_index = 0      # Index of the top-most loaded image in image_files
-        self.max_loaded_images = 5  # Maximum number of images kept in the view at one time
-        self.loaded_images = []     # List of QLabel widgets for loaded images
-
-        # Create QSettings to store resume positions. (You can change organization/app names as needed.)
+        self.current_index = 0      # Index of the image at the top of the viewport
+        self.current_offset = 0.0   # Position of the viewport top inside that image (fraction of its height)
+        self.recorded_position = None  # Last (index, offset) handed to the progress store
+        self.resume_position = None  # Restored (index, offset) to apply again once that image is ready
+        self.prefetch_pages = 2     # Number of images prepared below the viewport
+        # While scrolling, pages reached within prefetch_seconds at the current
+        # speed are prepared too, at most max_prefetch_pages beyond the viewport.
+        self.prefetch_seconds = 2.0
+        self.max_prefetch_pages = 12
+        self.failed_images = set()  # Indices of images that could not be decoded
+        self.tall_pages = {}        # index -> PagePlan of tall images that are shown tile by tile
+        self.decode_scales = {}     # index -> reduction factor the image was decoded at, if > 1
+        self.header_sizes = {}      # index -> (width, height) read from the file header
+        self.chapters = []          # Chapters in the strip, in reading order
+        self.chapter = None         # Chapter containing the viewport top; self.folder is its folder
+        # Near the end of the strip the next sibling chapter is appended to it
+        # ("reading/continue_chapters"); chapters more than keep_chapters away
+        # from the current one give up their cached images.
+        self.chapter_prefetch_pages = 5
+        self.keep_chapters = 1
+        self.scanning_next = False
+        self.last_chapter_reached = False
+
+        # Create QSettings to store preferences. (You can change organization/app names as needed.)
         self.settings = QSettings("MyCompany", "ImageViewer")
 
-        # Set up the scroll area and container widget
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.setCentralWidget(self.scroll_area)
-
-        self.container = QWidget()
-        self.layout = QVBoxLayout(self.container)
-        self.layout.setSpacing(0)  # No gap between images
-        self.scroll_area.setWidget(self.container)
+        # Reading positions of every folder; scrolling only updates memory and
+        # the positions are written at most every few seconds and on exit.
+        self.progress = ProgressStore(os.path.join(data_dir(), "progress.sqlite3"))
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setSingleShot(True)
+        self.progress_timer.setInterval(3000)
+        self.progress_timer.timeout.connect(self.progress.flush)
+        if continue_chapters is None:
+            continue_chapters = self.settings.value("reading/continue_chapters", True, type=bool)
+        self.continue_chapters = continue_chapters
+        # Sibling folders are scanned, and chapter packs opened, on their own
+        # thread so closing can wait for it.
+        self.scan_pool = QThreadPool(self)
+        self.scan_pool.setMaxThreadCount(1)
+        self.chapter_scanned.connect(self.on_chapter_scanned)
+
+        # Bytes of recently read archive members (MB).
+        archive.registry.cache.budget = self.settings.value(
+            "performance/archive_cache_mb", archive.DEFAULT_CACHE_MB, type=int) * 1024 * 1024
+
+        # Processed originals and display-scaled pixmaps share one memory budget (MB).
+        self.image_cache = PageImageCache(
+            self.settings.value("performance/cache_mb", DEFAULT_BUDGET_MB, type=int))
+
+        # File lists and header sizes of every opened folder, updated incrementally.
+        self.library = LibraryIndex(os.path.join(cache_dir(), "library.sqlite3"))
+
+        # Crop boxes and gap maps of pages already seen are kept on disk.
+        self.plan_cache = PlanCache(
+            os.path.join(cache_dir(), "plans.sqlite3"),
+            self.settings.value("performance/plan_cache_entries", DEFAULT_MAX_ENTRIES, type=int),
+        )
+
+        # Very tall images are spilled to disk once and then read tile by tile.
+        self.tile_store = TileStore(
+            cache_dir("tiles"),
+            self.settings.value("performance/tile_spill_mb", DEFAULT_SPILL_MB, type=int) * 1024 * 1024,
+        )
+
+        # Optional chapter packs ("performance/chapter_pack"): a chapter read
+        # once is written to disk already processed at the display width, and
+        # later sessions slice its rows instead of decoding.
+        self.use_packs = self.settings.value("performance/chapter_pack", False, type=bool)
+        self.pack = None            # ChapterPack of the current folder at the current width
+        self.pack_request = 0       # Number of the latest background open; older results are dropped
+        self.pack_store = PackStore(
+            cache_dir("packs"),
+            self.settings.value("performance/pack_mb", DEFAULT_PACK_MB, type=int) * 1024 * 1024,
+        )
+        self.pack_builder = PackBuilder(self.pack_store, self.plan_cache, self)
+        self.pack_builder.pack_ready.connect(self.on_pack_ready)
+        self.pack_opened.connect(self.on_pack_opened)
+        # Wait until the width has settled before building a pack for it.
+        self.pack_timer = QTimer(self)
+        self.pack_timer.setSingleShot(True)
+        self.pack_timer.setInterval(2000)
+        self.pack_timer.timeout.connect(self.build_pack)
+
+        # Decode and preprocess pages on background threads.
+        # "performance/worker_threads" = 0 uses one thread per core.
+        self.loader = PageLoader(
+            self.settings.value("performance/worker_threads", 0, type=int),
+            self.plan_cache, self.tile_store, self)
+        self.loader.page_ready.connect(self.on_image_ready)
+        self.loader.page_failed.connect(self.on_image_failed)
+        self.loader.tile_ready.connect(self.on_tile_ready)
+        self.loader.tile_failed.connect(self.on_tile_failed)
+        self.loader.scale_ready.connect(self.on_scale_ready)
+        # Decode large scans at a reduced size that still covers the viewport
+        # ("performance/reduced_decode" = false always decodes at full resolution).
+        self.loader.reduced_decode = self.settings.value("performance/reduced_decode", True, type=bool)
+        self.pack_builder.params = self.loader.params
+
+        # The whole folder is one virtual strip; only the visible slice is painted.
+        self.canvas = PageCanvas(self)
+        self.canvas.pixmap_provider = self.page_pixmap
+        self.canvas.page_label = lambda idx: str(idx - self.chapter_at(idx).start + 1)
+        # The white tail of one page and the white head of the next are collapsed
+        # like one gap ("reading/collapse_page_gaps"); "reading/keep_gap_height"
+        # rows of such a gap are kept. Both heights are in source-image pixels,
+        # like min_gap_height of the in-page rule.
+        if self.settings.value("reading/collapse_page_gaps", True, type=bool):
+            self.canvas.index.set_seam_gap((
+                self.loader.params["min_gap_height"],
+                self.settings.value("reading/keep_gap_height", preprocess.DEFAULT_KEEP_GAP_HEIGHT, type=int)))
+        self.setCentralWidget(self.canvas)
+        self.canvas.setFocus()
+
+        # Scroll speed drives how far ahead pages are prepared.
+        self.scroll_velocity = ScrollVelocity()
+        self.canvas.verticalScrollBar().valueChanged.connect(self.scroll_velocity.sample)
+
+        # Hands-free reading: A starts/stops, +/- change the speed.
+        self.auto_scroller = AutoScroller(
+            self.canvas.verticalScrollBar(),
+            self.settings.value("autoscroll/speed", DEFAULT_SPEED, type=float), self)
+        self.auto_scroller.state_changed.connect(self.update_title)
+
+        # Stage timings (P toggles them with an overlay, T exports them).
+        self.perf_overlay = PerfOverlay(self.canvas.viewport(), self.cache_summary)
+        if self.settings.value("performance/trace", False, type=bool):
+            self.toggle_perf_overlay()
+
+        # Thumbnail strip (M): thumbnails are made in the background at a
+        # reduced decode size and kept in one atlas file per chapter.
+        self.thumbnails = ThumbnailBuilder(
+            cache_dir("thumbnails"), self.settings.value("performance/thumbnail_threads", 1, type=int), self)
+        self.minimap = Minimap(self.canvas.viewport(), self.thumbnails)
+        self.minimap.page_clicked.connect(lambda idx: self.jump_to_page(idx + 1))
+
+        # Coalesce the scroll/resize notifications of one event loop pass into one check.
+        self.check_timer = QTimer(self)
+        self.check_timer.setSingleShot(True)
+        self.check_timer.setInterval(0)
+        self.check_timer.timeout.connect(self.check_load_images)
+        self.canvas.visible_changed.connect(self.check_timer.start)
+
+        # While the window is being resized the canvas stretches the pixmaps it
+        # already has; the smooth rescale runs once the width has settled.
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.rescale_images)
+        self.canvas.width_changed.connect(self.resize_timer.start)
 
         # Get image folder path
         if folder is None:
@@ -56,88 +218,358 @@ class ImageViewer(QMainWindow):
         self.folder = folder
 
         # If a resume breakpoint exists for this folder, load it.
-        # The key used is "resume/<folder path>"
-        saved_index = self.settings.value("resume/" + self.folder, None, type=int)
-        if saved_index is not None:
-            self.current_index = saved_index
-        else:
-            self.current_index = 0
+        self.restore_position()
 
         # Load the image list and preload initial images.
         self.load_image_list()
         self.preload_images()
 
+    def restore_position(self):
+        """读取当前文件夹的阅读进度（图片索引和图片内的位置）"""
+        position = self.progress.get(self.folder)
+        if position is not None:
+            self.current_index, self.current_offset = position.page, position.offset
+            return
+        # Breakpoints saved by older versions: "resume/<folder path>" = image index.
+        saved_index = self.settings.value("resume/" + self.folder, None, type=int)
+        self.current_index = saved_index if saved_index is not None else 0
+        self.current_offset = 0.0
+
+    def remember_position(self):
+        """记下视口顶部的位置，稍后批量写入"""
+        page, inner = self.canvas.scroll_position()
+        height = self.canvas.index.height(page)
+        offset = inner / height if height else 0.0
+        self.current_index, self.current_offset = page, offset
+        if (page, offset) == self.recorded_position:
+            return
+        self.recorded_position = (page, offset)
+        chapter = self.chapter_at(page)
+        if chapter is not self.chapter:
+            self.enter_chapter(chapter)
+        self.progress.update(chapter.folder, page - chapter.start, offset, chapter.count)
+        if not self.progress_timer.isActive():
+            self.progress_timer.start()
+
     def load_image_list(self):
-        """扫描文件夹中的图片文件，并按照文件名排序"""
-        valid_ext = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
-        self.image_files = [
-            os.path.join(self.folder, f)
-            for f in os.listdir(self.folder)
-            if os.path.splitext(f)[1].lower() in valid_ext
-        ]
-        self.image_files.sort()
+        """从漫画库索引取得文件夹（或压缩包）中的图片（按自然顺序排序）及文件头中的尺寸"""
+        try:
+            pages = self.library.chapter(self.folder)
+        except (OSError, zipfile.BadZipFile):
+            pages = []
+        self.image_files = [page.path for page in pages]
+        self.header_sizes = {i: (page.width, page.height) for i, page in enumerate(pages) if page.width > 0}
         if not self.image_files:
             QMessageBox.critical(self, "错误", f"在文件夹 {self.folder} 中没有找到图片文件。")
             sys.exit(1)
+        self.chapters = [Chapter(self.folder, 0, len(self.image_files))]
+        self.chapter = self.chapters[0]
+        self.scanning_next = False
+        self.last_chapter_reached = False
+        self.update_title()
+
+    def chapter_at(self, idx):
+        """第 idx 张图片所属的章节"""
+        i = bisect.bisect_right([chapter.start for chapter in self.chapters], idx) - 1
+        return self.chapters[max(0, i)]
+
+    def chapter_page(self, idx):
+        """第 idx 张图片在当前章节中的页号（0 起），不在本章时取本章最近的一页"""
+        start, count = self.chapter.start, self.chapter.count
+        return min(max(idx, start), start + count - 1) - start
+
+    def chapter_files(self, chapter):
+        return self.image_files[chapter.start:chapter.start + chapter.count]
+
+    def enter_chapter(self, chapter):
+        """视口顶部进入另一章：章节包、缩略图（都在后台打开）和标题改为这一章，释放离得较远的章节的图片"""
+        self.chapter = chapter
+        self.folder = chapter.folder
+        self.open_pack()
+        self.thumbnails.open(self.folder, self.chapter_files(chapter))
+        self.minimap.set_count(chapter.count)
+        if self.minimap.isVisible():
+            self.thumbnails.start(self.chapter_page(self.canvas.center_page()))
+        self.update_title()
+        self.release_far_chapters()
+
+    def release_far_chapters(self):
+        """取消离当前章节超过 keep_chapters 章的图片的任务，并把它们移出缓存"""
+        current = self.chapters.index(self.chapter)
+        for i, chapter in enumerate(self.chapters):
+            if abs(i - current) <= self.keep_chapters:
+                continue
+            lo, hi = chapter.start, chapter.start + chapter.count - 1
+            self.loader.cancel_if(lambda job: lo <= job.index <= hi)
+            for idx in range(lo, hi + 1):
+                self.image_cache.discard_page(idx)
+                self.tall_pages.pop(idx, None)
+                self.decode_scales.pop(idx, None)
+
+    def find_next_chapter(self):
+        """在后台查找并索引最后一章之后的下一章"""
+        if self.scanning_next or self.last_chapter_reached or not self.continue_chapters:
+            return
+        self.scanning_next = True
+        after = self.chapters[-1].folder
+        params = dict(self.loader.params)
+
+        def scan():
+            folder, pages, sizes = "", [], {}
+            try:
+                folder = self.library.next_chapter(after) or ""
+                if folder:
+                    pages = self.library.chapter(folder)
+                    sizes = {i: (page.width, page.height) for i, page in enumerate(pages) if page.width > 0}
+                    sizes.update(self.cached_page_sizes([page.path for page in pages], params))
+            except (OSError, zipfile.BadZipFile, sqlite3.Error) as exc:
+                log.warning("读取下一章失败 %s: %s", folder, exc)
+            self.chapter_scanned.emit(after, folder, pages, sizes)
+
+        self.scan_pool.start(scan)
+
+    def on_chapter_scanned(self, after, folder, pages, sizes):
+        """下一章索引完毕：把它的图片接在长条末尾，接近时照常预读"""
+        if not self.scanning_next or not self.chapters or self.chapters[-1].folder != after:
+            return  # Another folder was opened, or the window closed, meanwhile.
+        self.scanning_next = False
+        if not pages:
+            self.last_chapter_reached = True
+            return
+        chapter = Chapter(folder, len(self.image_files), len(pages))
+        self.chapters.append(chapter)
+        self.image_files.extend(page.path for page in pages)
+        for i, page in enumerate(pages):
+            if page.width > 0:
+                self.header_sizes[chapter.start + i] = (page.width, page.height)
+        self.canvas.append_pages(chapter.count, sizes)
+        self.check_timer.start()
 
     def preload_images(self):
-        """预加载从当前索引开始的若干张图片"""
-        for i in range(self.max_loaded_images):
-            idx = self.current_index + i
-            if idx < len(self.image_files):
-                self.add_image(idx, append=True)
-
-    def add_image(self, idx, append=True):
-        # Avoid duplicate loading.
-        if idx in [lbl.property("index") for lbl in self.loaded_images]:
-            return
+        """按已知的图片尺寸建立整个文件夹的虚拟长条，并加载当前索引附近的图片"""
+        self.current_index = min(self.current_index, len(self.image_files) - 1)
+        self.open_pack()
+        self.thumbnails.open(self.folder, self.image_files)
+        self.minimap.set_count(len(self.image_files))
+        if self.minimap.isVisible():
+            self.thumbnails.start(self.current_index)
+        self.canvas.set_pages(len(self.image_files), self.known_page_sizes(self.chapter))
+        offset = round(self.current_offset * self.canvas.index.height(self.current_index))
+        self.canvas.scroll_to_page(self.current_index, offset)
+        # The estimated height may differ from the processed one (cropped
+        # borders); apply the offset again once the real height is known.
+        self.resume_position = (self.current_index, self.current_offset) if self.current_offset else None
+        self.scroll_velocity.reset()  # A jump is not scrolling.
+        self.check_load_images()
+
+    def known_page_sizes(self, chapter):
+        """
+        返回 {章节内的索引: 尺寸}：已分析过的图片使用分析缓存中处理后的尺寸和上下空白，
+        其余的使用文件头中的原始尺寸，使滚动条一开始就接近整章高度
+        """
+        sizes = {idx - chapter.start: size for idx, size in self.header_sizes.items()
+                 if chapter.start <= idx < chapter.start + chapter.count}
+        sizes.update(self.cached_page_sizes(self.chapter_files(chapter), self.loader.params))
+        return sizes
+
+    def cached_page_sizes(self, paths, params):
+        """返回 {索引: 尺寸}：分析缓存中已有的图片处理后的尺寸、上下空白和解码缩小倍数（可在后台线程中调用）"""
+        sizes = {}
+        for idx, path in enumerate(paths):
+            try:
+                signature = file_signature(path)
+            except OSError:
+                continue
+            # Any decode scale gives the page's aspect ratio.
+            for scale in (1,) + DECODE_SCALES:
+                plan = self.plan_cache.peek(path, signature, dict(params, decode_scale=scale))
+                if plan is not None:
+                    sizes[idx] = (plan.width, plan.height, plan.head, plan.tail, scale)
+                    break
+        return sizes
 
-        image_path = self.image_files[idx]
-        orig_pixmap = QPixmap(image_path)
-        if orig_pixmap.isNull():
+    def viewport_width(self):
+        return self.canvas.display_width()
+
+    def keep_range(self, first, last):
+        """
+        返回需要保持加载的索引范围：可见的图片、上方一张和下方 prefetch_pages 张；
+        滚动时沿滚动方向再多准备 prefetch_seconds 秒内会滚过的图片（最多 max_prefetch_pages 张）
+        """
+        lo = max(0, first - 1)
+        hi = min(len(self.image_files) - 1, last + self.prefetch_pages)
+        ahead = int(self.scroll_velocity.velocity() * self.prefetch_seconds)
+        if ahead:
+            value = self.canvas.verticalScrollBar().value()
+            if ahead > 0:
+                edge = self.canvas.page_at(value + self.canvas.viewport().height() + ahead)
+                hi = max(hi, min(edge, last + self.max_prefetch_pages))
+            else:
+                edge = self.canvas.page_at(max(0, value + ahead))
+                lo = min(lo, max(edge, first - self.max_prefetch_pages))
+        return lo, hi
+
+    def page_pixmap(self, idx, width, tile=0):
+        """画布绘制时取第 idx 张图片（的第 tile 块）的显示图；宽度不符时先用其他宽度的缩放图代替"""
+        pixmap = self.image_cache.get_scaled(idx, width, tile)
+        if pixmap is None and self.pack_covers(idx, width):
+            pixmap = self.pack_pixmap(idx, width, tile)
+        if pixmap is None:
+            pixmap = self.image_cache.any_scaled(idx, tile)
+        return pixmap
+
+    def open_pack(self):
+        """在后台打开当前章节在当前宽度下的章节包（核对来源需要读取每张图片的文件信息）"""
+        if self.pack is not None:
+            self.pack.close()
+        self.pack = None
+        self.pack_request += 1
+        if not self.use_packs or not self.image_files:
+            return
+        request = self.pack_request
+        args = (self.folder, self.chapter_files(self.chapter), self.viewport_width(), dict(self.loader.params))
+
+        def open_in_background():
+            pack = None
+            try:
+                pack = self.pack_store.open(*args)
+            except Exception as exc:  # Never let an exception escape into Qt.
+                log.warning("打开章节包失败 %s: %s", args[0], exc)
+            self.pack_opened.emit(request, pack)
+
+        self.scan_pool.start(open_in_background)
+
+    def on_pack_opened(self, request, pack):
+        """章节包打开完毕：图片尺寸改用包中记录的尺寸，之后的图片直接从包中切片；没有时稍后在后台生成"""
+        if request != self.pack_request:
+            if pack is not None:
+                pack.close()
+            return
+        if pack is None:
+            self.pack_timer.start()
+            return
+        self.pack = pack
+        self.apply_pack_sizes()
+        self.check_timer.start()
+
+    def build_pack(self):
+        """在后台为当前文件夹和宽度生成章节包"""
+        width = self.viewport_width()
+        if not self.image_files or self.pack is not None and self.pack.width == width:
             return
+        target = int(width * self.devicePixelRatioF()) if self.loader.reduced_decode else 0
+        self.pack_builder.build(self.folder, self.chapter_files(self.chapter), width, target)
 
-        # Convert to QImage.
-        orig_image = orig_pixmap.toImage()
-        # Optionally, first crop the outer white border (if you already have a function for that).
-        cropped_image = self.crop_white_border(orig_image)
-        # Now remove the internal white gap.
-        processed_image = remove_internal_white_gap(cropped_image, threshold=240, white_ratio=0.98, min_gap_height=100)
-        orig_pixmap = QPixmap.fromImage(processed_image)
-
-        # Scale to fit the viewport.
-        viewport_width = self.scroll_area.viewport().width()
-        if viewport_width <= 0:
-            viewport_width = self.width()
-        scale_factor = viewport_width / orig_pixmap.width()
-        new_width = viewport_width
-        new_height = int(orig_pixmap.height() * scale_factor)
-        scaled_pixmap = orig_pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-        label = QLabel()
-        label.setPixmap(scaled_pixmap)
-        label.setProperty("index", idx)
-        label.setProperty("pixmap_orig", orig_pixmap)
-
-        scroll_bar = self.scroll_area.verticalScrollBar()
-        if append:
-            was_at_bottom = (scroll_bar.value() >= scroll_bar.maximum() - 50)
-            if was_at_bottom:
-                old_scroll_value = scroll_bar.value()
-            self.layout.addWidget(label)
-            self.loaded_images.append(label)
-            removed_total = self.cleanup_images("top")
-            if was_at_bottom:
-                scroll_bar.setValue(old_scroll_value - removed_total)
+    def on_pack_ready(self, folder, width):
+        """章节包生成完毕：之后的图片直接从包中切片"""
+        if folder != self.folder or width != self.viewport_width():
+            return
+        self.open_pack()
+
+    def apply_pack_sizes(self):
+        """画布中的图片尺寸改用章节包中记录的处理后尺寸"""
+        for idx, size in self.pack.sizes().items():
+            self.canvas.set_page_size(self.chapter.start + idx, *size)
+
+    def pack_covers(self, idx, width):
+        """第 idx 张图片可以从当前章节的章节包中取得"""
+        return (self.pack is not None and self.pack.width == width
+                and self.chapter.start <= idx < self.chapter.start + self.chapter.count)
+
+    def pack_pixmap(self, idx, width, tile=0):
+        """从章节包中切出第 idx 张图片（第 tile 块）的显示行，放入显示图缓存"""
+        tile_bands = self.canvas.page_tiles(idx)
+        if tile >= len(tile_bands):
+            return None
+        _, a, b = tile_bands[tile]
+        with perftrace.span("pack_slice"):
+            rows = self.pack.page_rows(idx - self.chapter.start, a, b)
+            if not len(rows):
+                return None
+            pixmap = self.to_pixmap(rgb_to_qimage(rows))
+        self.image_cache.put_scaled(idx, width, pixmap, tile)
+        return pixmap
+
+    def prepare_from_pack(self, idx, width):
+        """用章节包准备第 idx 张图片的显示图（长条图片只准备视口附近的分块）"""
+        bands = self.canvas.page_tiles(idx)
+        wanted = [t for t, _, _ in bands] if len(bands) == 1 else \
+            self.canvas.tiles_in_view(idx, margin=self.canvas.viewport().height())
+        for tile in wanted:
+            if not self.image_cache.has_scaled(idx, width, tile) and self.pack_pixmap(idx, width, tile) is not None:
+                self.canvas.update_page(idx)
+
+    def request_image(self, idx):
+        """让后台线程准备第 idx 张图片（已在处理时不重复提交）"""
+        self.loader.pixel_ratio = self.devicePixelRatioF()
+        self.loader.request(idx, self.image_files[idx], self.viewport_width())
+
+    @perftrace.traced("image_ready")
+    def on_image_ready(self, result):
+        """后台线程处理完一张图片：更新它在长条中的真实高度，并放入缓存"""
+        idx = result.index
+        plan = result.plan
+        self.canvas.set_page_size(idx, plan.width, plan.height, plan.head, plan.tail, result.scale)
+        if self.resume_position and self.resume_position[0] == idx:
+            fraction = self.resume_position[1]
+            self.resume_position = None
+            if self.canvas.scroll_position()[0] == idx:
+                self.canvas.scroll_to_page(idx, round(fraction * self.canvas.index.height(idx)))
+        if result.scale > 1:
+            self.decode_scales[idx] = result.scale
         else:
-            old_value = scroll_bar.value()
-            self.layout.insertWidget(0, label)
-            self.loaded_images.insert(0, label)
-            new_height = label.sizeHint().height()
-            scroll_bar.setValue(old_value + new_height)
-            self.cleanup_images("bottom")
-
-
+            self.decode_scales.pop(idx, None)
+        if result.image is None:
+            # Tall image: its rows are on disk now and are loaded tile by tile.
+            self.tall_pages[idx] = result.plan
+            self.check_timer.start()
+        else:
+            self.add_image(idx, result)
+
+    def on_image_failed(self, idx):
+        """图片无法解码时把它的高度设为 0，后面的图片照常显示"""
+        self.failed_images.add(idx)
+        self.canvas.set_page_size(idx, 1, 0)
+
+    @perftrace.traced("tile_ready")
+    def on_tile_ready(self, result):
+        """后台线程读取并缩放好长条图片的一块"""
+        plan = self.tall_pages.get(result.index)
+        if plan is None:
+            return
+        self.image_cache.put_original(result.index, result.image, result.tile)
+        self.image_cache.put_scaled(result.index, result.width, self.to_pixmap(result.scaled), result.tile)
+        if result.width != self.viewport_width():
+            # The window was resized while the tile was being read.
+            self.prepare_tiles(result.index, plan, self.viewport_width(), *self.canvas.visible_pages())
+        self.canvas.update_page(result.index)
+
+    def on_tile_failed(self, idx, tile):
+        """分块文件已被清理：重新处理整张图片以重建它"""
+        self.tall_pages.pop(idx, None)
+        self.check_timer.start()
+
+    @perftrace.traced("scale_ready")
+    def on_scale_ready(self, result):
+        """后台线程完成了一次高质量重新缩放"""
+        self.image_cache.put_scaled(result.index, result.width, self.to_pixmap(result.scaled), result.tile)
+        self.canvas.update_page(result.index)
+
+    def to_pixmap(self, image):
+        """把后台线程生成的 QImage 转换为可以直接绘制的 QPixmap"""
+        with perftrace.span("to_pixmap"):
+            return QPixmap.fromImage(image)
+
+    @perftrace.traced("add_image")
+    def add_image(self, idx, result):
+        """把后台处理好的图片放入缓存并刷新画布"""
+        self.image_cache.put_original(idx, result.image)
+        self.image_cache.put_scaled(idx, result.width, self.to_pixmap(result.scaled))
+
+        # The window was resized while the image was being processed.
+        if result.width != self.viewport_width():
+            self.prepare_image(idx, self.viewport_width())
+        self.canvas.update_page(idx)
 
     def crop_white_border(self, image, threshold=240):
         """
@@ -146,168 +578,208 @@ class ImageViewer(QMainWindow):
         :param threshold: 判定白色的阈值（0~255），默认240
         :return: 裁剪后的 QImage 对象
         """
-        width = image.width()
-        height = image.height()
-        left, top = 0, 0
-        right, bottom = width - 1, height - 1
-
-        # 找到顶部边界
-        found_top = False
-        for y in range(height):
-            for x in range(width):
-                color = image.pixelColor(x, y)
-                if color.red() < threshold or color.green() < threshold or color.blue() < threshold:
-                    top = y
-                    found_top = True
-                    break
-            if found_top:
-                break
-
+        arr, _rgba = qimage_view(image)
+        mask = preprocess.white_mask(arr, threshold)
+        box = preprocess.content_box(
+            mask.sum(axis=1), mask.sum(axis=0), image.width(), image.height())
         # 如果整个图像都是白色，则返回原图
-        if not found_top:
+        if box is None:
             return image
 
-        # 找到底部边界
-        found_bottom = False
-        for y in range(height - 1, -1, -1):
-            for x in range(width):
-                color = image.pixelColor(x, y)
-                if color.red() < threshold or color.green() < threshold or color.blue() < threshold:
-                    bottom = y
-                    found_bottom = True
-                    break
-            if found_bottom:
-                break
-
-        # 找到左侧边界
-        found_left = False
-        for x in range(width):
-            for y in range(top, bottom + 1):
-                color = image.pixelColor(x, y)
-                if color.red() < threshold or color.green() < threshold or color.blue() < threshold:
-                    left = x
-                    found_left = True
-                    break
-            if found_left:
-                break
-
-        # 找到右侧边界
-        found_right = False
-        for x in range(width - 1, -1, -1):
-            for y in range(top, bottom + 1):
-                color = image.pixelColor(x, y)
-                if color.red() < threshold or color.green() < threshold or color.blue() < threshold:
-                    right = x
-                    found_right = True
-                    break
-            if found_right:
-                break
-
         # 定义裁剪区域并返回裁剪后的图像
-        rect = QRect(left, top, right - left + 1, bottom - top + 1)
-        return image.copy(rect)
+        left, top, right, bottom = box
+        return image.copy(QRect(left, top, right - left, bottom - top))
 
-    def cleanup_images(self, remove_direction):
+    @perftrace.traced("cleanup_images")
+    def cleanup_images(self, lo, hi):
+        """
+        取消 [lo, hi] 范围之外的后台任务，并记下断点（视口顶部的图片和图片内的位置）。
+        内存由 image_cache 按预算淘汰，这里不再移除图片。
+        """
+        self.loader.cancel_outside(lo, hi)
+        self.remember_position()
+
+    @perftrace.traced("check_load_images")
+    def check_load_images(self):
         """
-        清理超出范围的图片，确保最多保留 max_loaded_images 张。
-        当从顶部移除图片时，返回移除的总高度以便调整滚动条。
-        :param remove_direction: 'top' 表示从列表顶部移除，
-                                'bottom' 表示从列表底部移除。
-        :return: total_removed_height (int) when removing from the top,
-                0 otherwise.
+        根据视口位置准备附近的图片：缺少显示图时优先用缓存中的原图重新缩放，
+        原图也不在缓存中时才交给后台线程解码。长条图片只准备视口附近的分块。
         """
-        total_removed = 0
-        while len(self.loaded_images) > self.max_loaded_images:
-            if remove_direction == "top":
-                removed = self.loaded_images.pop(0)
-            elif remove_direction == "bottom":
-                removed = self.loaded_images.pop(-1)
+        if not self.image_files:
+            return
+        first, last = self.canvas.visible_pages()
+        lo, hi = self.keep_range(first, last)
+        width = self.viewport_width()
+        if self.minimap.isVisible():
+            self.minimap.set_current(self.chapter_page(first), self.chapter_page(last))
+        if last >= len(self.image_files) - self.chapter_prefetch_pages:
+            self.find_next_chapter()
+
+        # 按与视口的距离排列后台任务
+        center = self.canvas.center_page()
+        center_tiles = self.canvas.tiles_in_view(center)
+        self.loader.set_focus(center, center_tiles[len(center_tiles) // 2] if center_tiles else 0)
+        for idx in sorted(range(lo, hi + 1), key=lambda i: abs(i - center)):
+            if idx in self.failed_images:
+                continue
+            if self.pack_covers(idx, width):
+                self.prepare_from_pack(idx, width)
+                continue
+            plan = self.tall_pages.get(idx)
+            if plan is not None and not self.resize_timer.isActive() and self.needs_larger_decode(idx, plan.width, width):
+                del self.tall_pages[idx]
+                plan = None
+            if plan is None:
+                self.prepare_image(idx, width)
             else:
-                removed = self.loaded_images.pop(0)
-            removed_height = removed.sizeHint().height()
-            total_removed += removed_height
-            self.layout.removeWidget(removed)
-            removed.deleteLater()
-
-        # Update current_index to be that of the topmost loaded image
-        if self.loaded_images:
-            self.current_index = self.loaded_images[0].property("index")
-        else:
-            self.current_index = 0
+                self.prepare_tiles(idx, plan, width, first, last)
 
-        # Save the current breakpoint (i.e. the top image index) for the current folder.
-        self.settings.setValue("resume/" + self.folder, self.current_index)
-        
-        return total_removed  # Return value useful if cleanup was called after inserting at the top.
+        self.cleanup_images(lo, hi)
 
-    def wheelEvent(self, event: QWheelEvent):
-        """重载鼠标滚轮事件，延迟检查加载新图片"""
-        super().wheelEvent(event)
-        from PyQt5.QtCore import QTimer
-        QTimer.singleShot(0, self.check_load_images)
+    def needs_larger_decode(self, idx, plan_width, width):
+        """图片是缩小解码的，但当前宽度需要的像素比它多（窗口变大或换到高分屏）"""
+        return idx in self.decode_scales and plan_width < int(width * self.devicePixelRatioF())
 
-    def check_load_images(self):
-        """检查滚动条的位置，根据视口高度动态调整触发阈值"""
-        scroll_bar = self.scroll_area.verticalScrollBar()
-        value = scroll_bar.value()
-        maximum = scroll_bar.maximum()
-        viewport_height = self.scroll_area.viewport().height()
-
-        # 动态计算触发阈值（视口高度的1/3）
-        threshold = max(50, viewport_height // 3)  # 至少保留50px的触发区域
-
-        # 检查底部（当距离底部小于阈值时加载）
-        if maximum > 0 and value >= maximum - threshold:
-            if self.loaded_images:
-                next_idx = self.loaded_images[-1].property("index") + 1
-                if next_idx < len(self.image_files):
-                    self.add_image(next_idx, append=True)
-
-        # 检查顶部（当距离顶部小于阈值时加载）
-        elif value <= threshold:
-            if self.loaded_images:
-                prev_idx = self.loaded_images[0].property("index") - 1
-                if prev_idx >= 0:
-                    self.add_image(prev_idx, append=False)
-
-    def resizeEvent(self, event):
+    def prepare_image(self, idx, width):
+        """确保第 idx 张（未分块的）图片有当前宽度的显示图"""
+        if self.image_cache.has_scaled(idx, width):
+            return
+        original = self.image_cache.get_original(idx)
+        if original is None:
+            self.request_image(idx)
+        elif self.resize_timer.isActive() and self.image_cache.any_scaled(idx) is not None:
+            return  # Stretch the old pixmap until the width settles.
+        elif self.needs_larger_decode(idx, original.width(), width):
+            self.request_image(idx)
+        else:
+            height = display_height(original.width(), original.height(), width)
+            self.loader.request_scale(idx, 0, original, width, height)
+
+    def prepare_tiles(self, idx, plan, width, first, last):
+        """为长条图片准备视口上下一屏范围内的分块，取消其余分块的任务"""
+        wanted = self.canvas.tiles_in_view(idx, margin=self.canvas.viewport().height())
+        if idx > last:
+            wanted.append(0)
+        elif idx < first:
+            wanted.append(tile_count(plan.height) - 1)
+        self.loader.cancel_if(lambda job: job.index == idx and job.tile is not None and job.tile not in wanted)
+        for tile in wanted:
+            if self.image_cache.has_scaled(idx, width, tile):
+                continue
+            original = self.image_cache.get_original(idx, tile)
+            if original is None:
+                self.loader.request_tile(idx, tile, self.image_files[idx], width, plan)
+            elif not (self.resize_timer.isActive() and self.image_cache.any_scaled(idx, tile) is not None):
+                a, b = display_band(plan.width, plan.height, width, tile)
+                self.loader.request_scale(idx, tile, original, width, max(1, b - a))
+
+    @perftrace.traced("rescale_images")
+    def rescale_images(self):
         """
-        重载窗口尺寸变化事件，重新计算所有已加载图片的缩放比例，
-        使其根据当前 viewport 宽度自动缩放。
+        窗口尺寸稳定后，在后台为附近的图片生成新宽度的显示图（可见的优先），
+        旧宽度的显示图仍保留在缓存中，切换回原来的尺寸时可以直接使用。
         """
-        if not hasattr(self, "scroll_area"):
-            return super().resizeEvent(event)
-        viewport_width = self.scroll_area.viewport().width()
-        if viewport_width <= 0:
-            viewport_width = self.width()
-        for label in self.loaded_images:
-            orig_pixmap = label.property("pixmap_orig")
-            if not isinstance(orig_pixmap, QPixmap) or orig_pixmap.isNull():
-                continue
-            scale_factor = viewport_width / orig_pixmap.width()
-            new_width = viewport_width
-            new_height = int(orig_pixmap.height() * scale_factor)
-            scaled_pixmap = orig_pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            label.setPixmap(scaled_pixmap)
-            label.resize(scaled_pixmap.size())
-        super().resizeEvent(event)
+        self.loader.cancel_stale_scales(self.viewport_width())
+        if self.use_packs and not (self.pack is not None and self.pack.width == self.viewport_width()):
+            self.open_pack()
+        self.check_load_images()
+
+    def cache_summary(self):
+        """图片缓存、分析缓存和像素复制的统计，每项一行"""
+        stats = self.image_cache.stats()
+        lines = []
+        for tier, name in (("originals", "原图"), ("scaled", "显示图")):
+            st = stats[tier]
+            lines.append("{}：{} 张，{:.1f} / {:.0f} MB，命中 {}，未命中 {}，淘汰 {}".format(
+                name, st["entries"], st["bytes"] / 2**20, st["budget"] / 2**20,
+                st["hits"], st["misses"], st["evictions"]))
+        lines.append("分析缓存：命中 {}，未命中 {}".format(self.plan_cache.hits, self.plan_cache.misses))
+        if self.pack is not None:
+            lines.append("章节包：宽度 {}，{} 张".format(self.pack.width, len(self.pack)))
+        elif self.pack_builder.is_building(self.folder, self.viewport_width()):
+            lines.append("章节包：生成中")
+        st = archive.registry.cache.stats()
+        lines.append("压缩包缓存：{} 张，{:.1f} / {:.0f} MB，命中 {}，未命中 {}".format(
+            st["entries"], st["bytes"] / 2**20, st["budget"] / 2**20, st["hits"], st["misses"]))
+        bridge = qtimage.stats.snapshot()
+        lines.append("像素复制：{:.1f} MB，分配 {} 次，格式转换 {} 次".format(
+            bridge["bytes_copied"] / 2**20, bridge["allocations"], bridge["conversions"]))
+        scroller = self.auto_scroller
+        lines.append("滚动速度 {:.0f} 像素/秒，自动滚动 {:.0f} 像素/秒，掉帧 {} / {}，预读未命中 {}".format(
+            self.scroll_velocity.velocity(), scroller.speed, scroller.dropped_frames, scroller.frames,
+            self.canvas.misses))
+        return lines
+
+    def update_title(self):
+        """自动滚动时在标题栏显示速度"""
+        title = "无缝滚动图片浏览器"
+        if self.chapter is not None:
+            title += " — " + os.path.basename(self.chapter.folder.rstrip(os.sep))
+        if self.auto_scroller.is_running():
+            title += " — 自动滚动 {:.0f} 像素/秒".format(self.auto_scroller.speed)
+        self.setWindowTitle(title)
+
+    def change_autoscroll_speed(self, faster):
+        """调整自动滚动速度并保存"""
+        if faster:
+            self.auto_scroller.faster()
+        else:
+            self.auto_scroller.slower()
+        self.settings.setValue("autoscroll/speed", self.auto_scroller.speed)
+        self.update_title()
+
+    def show_cache_stats(self):
+        """显示图片缓存的命中率和内存占用"""
+        QMessageBox.information(self, "缓存统计", "\n".join(self.cache_summary()))
+
+    def toggle_minimap(self):
+        """显示/隐藏缩略图导航栏，第一次显示时开始在后台生成缺少的缩略图"""
+        if self.minimap.isVisible():
+            self.minimap.hide()
+            return
+        self.minimap.show()
+        self.minimap.raise_()
+        first, last = self.canvas.visible_pages()
+        self.minimap.set_current(self.chapter_page(first), self.chapter_page(last))
+        self.thumbnails.start(self.chapter_page(self.canvas.center_page()))
+
+    def toggle_perf_overlay(self):
+        """开始/停止记录各阶段耗时，并显示/隐藏性能面板"""
+        perftrace.tracer.enabled = not perftrace.tracer.enabled
+        self.perf_overlay.set_active(perftrace.tracer.enabled)
+
+    def export_trace(self):
+        """把记录的耗时导出为 Chrome trace JSON 和按阶段汇总的 CSV"""
+        if not perftrace.tracer.events:
+            QMessageBox.information(self, "导出耗时记录", "没有记录。按 P 开始记录。")
+            return
+        base = os.path.join(cache_dir("traces"), time.strftime("trace-%Y%m%d-%H%M%S"))
+        perftrace.tracer.export_chrome(base + ".json")
+        perftrace.tracer.export_csv(base + ".csv")
+        QMessageBox.information(self, "导出耗时记录", "已保存到：\n{}.json\n{}.csv".format(base, base))
 
     def keyPressEvent(self, event):
         """
         重载键盘按键事件：
         - 按下 'g' 键时弹出对话框，输入想要跳转的页码。
         - 按下 'o' 键时弹出文件夹选择对话框，重新加载其他文件夹中的图片。
+        - 按下 'Z' 键时选择 CBZ/ZIP 压缩包，不解压直接阅读其中的图片。
         - 按下 'F' 键时切换全屏模式。
         - 按下 'R' 键时重置断点（resume breakpoint）。
+        - 按下 'I' 键时显示缓存统计。
+        - 按下 'P' 键时开始/停止记录各阶段耗时并显示性能面板。
+        - 按下 'T' 键时导出耗时记录（Chrome trace JSON 和 CSV）。
+        - 按下 'A' 键时开始/停止自动滚动，'+' / '-' 键调整自动滚动速度。
+        - 按下 'M' 键时显示/隐藏缩略图导航栏，点击缩略图跳到该页。
         """
         if event.key() == Qt.Key_G:
             page, ok = QInputDialog.getInt(
                 self,
                 "跳转页面",
-                "请输入跳转页码（1-{}）：".format(len(self.image_files)),
-                value=self.current_index + 1,
+                "请输入跳转页码（1-{}）：".format(self.chapter.count),
+                value=self.current_index - self.chapter.start + 1,
                 min=1,
-                max=len(self.image_files),
+                max=self.chapter.count,
             )
             if ok:
                 self.jump_to_page(page)
@@ -315,6 +787,9 @@ class ImageViewer(QMainWindow):
         elif event.key() == Qt.Key_O:
             self.reload_folder()
             return
+        elif event.key() == Qt.Key_Z:
+            self.reload_archive()
+            return
         elif event.key() == Qt.Key_F:
             # Toggle fullscreen mode.
             if self.isFullScreen():
@@ -324,80 +799,105 @@ class ImageViewer(QMainWindow):
             return
         elif event.key() == Qt.Key_R:
             # Reset the saved resume position for this folder.
+            self.progress.remove(self.folder)
             self.settings.remove("resume/" + self.folder)
             self.current_index = 0  # Optionally reset the current index.
+            self.current_offset = 0.0
             QMessageBox.information(self, "断点重置", "断点已重置，下次打开将从头开始。")
             return
+        elif event.key() == Qt.Key_I:
+            self.show_cache_stats()
+            return
+        elif event.key() == Qt.Key_P:
+            self.toggle_perf_overlay()
+            return
+        elif event.key() == Qt.Key_T:
+            self.export_trace()
+            return
+        elif event.key() == Qt.Key_A:
+            self.auto_scroller.toggle()
+            return
+        elif event.key() == Qt.Key_M:
+            self.toggle_minimap()
+            return
+        elif event.key() in (Qt.Key_Plus, Qt.Key_Equal, Qt.Key_Minus):
+            self.change_autoscroll_speed(event.key() != Qt.Key_Minus)
+            return
 
         super().keyPressEvent(event)
 
     def jump_to_page(self, page):
         """
-        执行页面跳转：
-        清空当前加载的图片列表，并从指定页码处重新加载图片。
+        执行页面跳转（页码从当前章节的第一页算起）：直接滚动到该页在虚拟长条中的偏移位置。
         """
-        target_index = page - 1
-        if target_index < 0 or target_index >= len(self.image_files):
+        if page < 1 or page > self.chapter.count:
             QMessageBox.warning(self, "跳转失败", "输入的页码无效！")
             return
+        target_index = self.chapter.start + page - 1
 
-        # 清空当前已加载的图片
-        for label in self.loaded_images:
-            self.layout.removeWidget(label)
-            label.deleteLater()
-        self.loaded_images.clear()
-
-        # 更新当前索引，并重新预加载图片
         self.current_index = target_index
-        self.preload_images()
-
-        # 将滚动条置顶
-        self.scroll_area.verticalScrollBar().setValue(0)
+        self.canvas.scroll_to_page(target_index)
+        self.scroll_velocity.reset()
+
+    def clear_images(self):
+        """移除所有已加载的图片并取消后台任务"""
+        self.loader.cancel_all()
+        self.pack_builder.cancel()
+        self.pack_timer.stop()
+        self.image_cache.clear()
+        self.failed_images.clear()
+        self.tall_pages.clear()
+        self.decode_scales.clear()
+        self.canvas.viewport().update()
+
+    def closeEvent(self, event):
+        """退出前等待后台线程结束"""
+        self.loader.shutdown()
+        self.pack_builder.shutdown()
+        self.thumbnails.shutdown()
+        # A scan result or pack still waiting in the event queue is ignored.
+        self.scan_pool.waitForDone()
+        self.scanning_next = False
+        self.pack_request += 1
+        self.last_chapter_reached = True
+        self.plan_cache.close()
+        self.library.close()
+        if self.image_files:
+            self.remember_position()
+        self.progress.close()
+        super().closeEvent(event)
 
     def reload_folder(self):
         """重新加载文件夹"""
         folder = QFileDialog.getExistingDirectory(self, "选择新的图片文件夹", os.getcwd())
         if not folder:
             return
+        self.open_folder(folder)
+
+    def reload_archive(self):
+        """打开一个漫画压缩包"""
+        patterns = " ".join("*" + ext for ext in sorted(archive.ARCHIVE_EXTENSIONS))
+        path, _ = QFileDialog.getOpenFileName(self, "选择漫画压缩包", os.getcwd(), f"漫画压缩包 ({patterns})")
+        if not path:
+            return
+        self.open_folder(path)
 
+    def open_folder(self, folder):
+        """切换到另一个文件夹或压缩包"""
+        if self.image_files:
+            self.remember_position()
+        self.progress.flush()
         self.folder = folder
 
         # Attempt to load a resume breakpoint for the new folder.
-        saved_index = self.settings.value("resume/" + self.folder, None, type=int)
-        if saved_index is not None:
-            self.current_index = saved_index
-        else:
-            self.current_index = 0
+        self.restore_position()
 
         # 清空当前已加载的图片
-        for label in self.loaded_images:
-            self.layout.removeWidget(label)
-            label.deleteLater()
-        self.loaded_images.clear()
+        self.clear_images()
 
         # 重新加载图片列表和预加载图片
         self.load_image_list()
         self.preload_images()
-        self.scroll_area.verticalScrollBar().setValue(0)
-
-def qimage_to_cv(qimage):
-    """Convert a QImage into an OpenCV (BGR) image."""
-    qimage = qimage.convertToFormat(QImage.Format_RGBA8888)
-    width = qimage.width()
-    height = qimage.height()
-    ptr = qimage.bits()
-    ptr.setsize(qimage.byteCount())
-    arr = np.array(ptr).reshape(height, width, 4)
-    # Convert RGBA to BGR
-    return cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR)
-
-def cv_to_qimage(cv_img):
-    """Convert an OpenCV (BGR) image to QImage."""
-    height, width, channel = cv_img.shape
-    bytesPerLine = 3 * width
-    # Convert BGR to RGB
-    rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-    return QImage(rgb_image.data, width, height, bytesPerLine, QImage.Format_RGB888).copy()
 
 def collapse_white_gaps(qimage, threshold=240, white_ratio=0.98):
     """
@@ -412,32 +912,12 @@ def collapse_white_gaps(qimage, threshold=240, white_ratio=0.98):
     Returns:
       A new QImage with the white rows/columns removed.
     """
-    # Convert to OpenCV image.
-    cv_img = qimage_to_cv(qimage)
-    h, w, _ = cv_img.shape
-
-    # Create a mask: 1 for white-ish pixels, 0 for others.
-    # A pixel is white-ish if all its channels are >= threshold.
-    white_mask = np.all(cv_img >= threshold, axis=2).astype(np.uint8)
-
-    # For each row, compute the fraction of white pixels.
-    white_fraction_rows = white_mask.mean(axis=1)  # shape (h,)
-    rows_to_keep = np.where(white_fraction_rows < white_ratio)[0]
-
-    # For each column, compute the fraction of white pixels (using only kept rows).
-    if len(rows_to_keep) == 0:
-        # If all rows are white, return the original image.
-        return qimage
-    white_fraction_cols = white_mask[rows_to_keep, :].mean(axis=0)  # shape (w,)
-    cols_to_keep = np.where(white_fraction_cols < white_ratio)[0]
-
-    # If no rows or columns are kept, return the original.
-    if len(rows_to_keep) == 0 or len(cols_to_keep) == 0:
+    arr, image = qimage_view(qimage)
+    plan = preprocess.analyze_collapse(arr, threshold, white_ratio)
+    if plan.rows == ((0, plan.src_height),) and plan.width == plan.src_width:
+        # If all rows or columns are white, return the original image.
         return qimage
-
-    # Collapse the image by keeping only the selected rows and columns.
-    collapsed_img = cv_img[rows_to_keep[0]:rows_to_keep[-1]+1, cols_to_keep[0]:cols_to_keep[-1]+1]
-    return cv_to_qimage(collapsed_img)
+    return render_plan(arr, plan, image.format())
 
 def remove_internal_white_gap(qimage, threshold=240, white_ratio=0.98, min_gap_height=5):
     """
@@ -453,50 +933,19 @@ def remove_internal_white_gap(qimage, threshold=240, white_ratio=0.98, min_gap_h
     :param min_gap_height: Only remove a contiguous white block if it has at least this many rows.
     :return: A new QImage with the internal white gap removed.
     """
-    # Convert QImage to an OpenCV image (BGR)
-    cv_img = qimage_to_cv(qimage)
-    h, w, _ = cv_img.shape
-
-    # Create a boolean mask: True if a pixel is white (all channels >= threshold)
-    white_mask = np.all(cv_img >= threshold, axis=2)
-    # Compute the fraction of white pixels in each row.
-    row_white_fraction = np.mean(white_mask, axis=1)  # shape: (h,)
-    # Identify rows that are almost entirely white.
-    white_rows = row_white_fraction >= white_ratio
-
-    # Determine which rows to keep.
-    indices_to_keep = []
-    i = 0
-    while i < h:
-        if white_rows[i]:
-            # Find the contiguous block of white rows.
-            j = i
-            while j < h and white_rows[j]:
-                j += 1
-            block_height = j - i
-            # Remove the block only if it is strictly internal (i > 0 and j < h)
-            # and if the block is thick enough.
-            if i > 0 and j < h and block_height >= min_gap_height:
-                # Skip these rows (i.e. do not add them to indices_to_keep)
-                pass
-            else:
-                # Otherwise, keep these rows.
-                indices_to_keep.extend(range(i, j))
-            i = j
-        else:
-            indices_to_keep.append(i)
-            i += 1
-
-    # If no rows are kept, return the original image.
-    if not indices_to_keep:
-        return qimage
-
-    # Create a new image from the selected rows.
-    new_cv_img = cv_img[indices_to_keep, :, :]
-    return cv_to_qimage(new_cv_img)
+    arr, image = qimage_view(qimage)
+    plan = preprocess.analyze(arr, threshold, white_ratio, min_gap_height, crop=False)
+    return render_plan(arr, plan, image.format())
 
 
 if __name__ == "__main__":
+    # Background threads report failures through their module's logger.
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # "imgviewer.py batch ..." runs the headless batch processor instead of the viewer.
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        import batch
+        sys.exit(batch.main(sys.argv[2:]))
+
     app = QApplication(sys.argv)
     viewer = ImageViewer()
     viewer.show()
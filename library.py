@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+漫画库索引。
+
+每个章节文件夹中的图片列表（按自然顺序排序）和每张图片的尺寸保存在 SQLite 中。
+尺寸只读取文件头得到，不解码像素；文件夹的修改时间没有变化时直接使用索引，
+不再扫描目录，变化时也只重新读取新增或改动过的文件。CBZ/ZIP 压缩包和文件夹
+一样作为章节索引，其中的图片使用 archive 模块的虚拟路径。
+"""
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zipfile
+from collections import namedtuple
+
+import archive
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+
+# One image of a chapter; width/height are 0 when the header could not be read.
+Page = namedtuple("Page", ["path", "width", "height"])
+
+_DIGITS = re.compile(r"(\d+)")
+
+# A directory changed this recently may still change within the same mtime
+# tick on coarse file systems, so its listing is not trusted yet.
+MTIME_SETTLE_NS = 2 * 10**9
+
+
+def natural_key(name):
+    """Sort key that orders "2.jpg" before "10.jpg" and ignores case."""
+    parts = _DIGITS.split(name.lower())
+    # Odd positions are digit runs; keep the text so "01" and "1" still differ.
+    return [(int(p), p) if i % 2 else p for i, p in enumerate(parts)]
+
+
+def is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+# JPEG start-of-frame markers (everything in C0-CF except DHT, JPG and DAC).
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue  # Markers without a length field.
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if marker in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+def probe_stream(f):
+    """Like probe_size, for a seekable binary stream positioned at the start of the image."""
+    head = f.read(26)
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", head[6:10])
+    if head.startswith(b"BM") and len(head) >= 26:
+        width, height = struct.unpack("<ii", head[18:26])
+        return width, abs(height)
+    if head.startswith(b"\xff\xd8"):
+        return _jpeg_size(f)
+    return None
+
+
+def probe_size(path):
+    """
+    Read the pixel size of an image (a file or an archive member) from its header only.
+
+    Supports JPEG, PNG, GIF and BMP.
+    :return: (width, height), or None if the header is not recognised
+    """
+    try:
+        if archive.split_path(path) is not None:
+            return probe_stream(archive.head_stream(path))
+        with open(path, "rb") as f:
+            return probe_stream(f)
+    except (OSError, struct.error, KeyError, zipfile.BadZipFile):
+        pass
+    return None
+
+
+class LibraryIndex:
+    """
+    Persistent index of chapter folders and the sizes of their pages.
+
+    A folder is rescanned only when its modification time changed, which
+    happens whenever a file is added, removed or renamed in it; during a
+    rescan only new or changed files (by size and mtime) have their headers read.
+    An archive is indexed the same way under its own path, with the archive's
+    modification time standing in for that of its members.
+    Like PlanCache, one connection is shared by all threads behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS folders ("
+            " path TEXT PRIMARY KEY, mtime INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " folder TEXT NOT NULL, name TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime INTEGER NOT NULL,"
+            " width INTEGER NOT NULL, height INTEGER NOT NULL,"
+            " PRIMARY KEY (folder, name))"
+        )
+        self.scans = 0   # Folders whose directory listing had to be read
+        self.probes = 0  # Image headers read
+
+    def chapter(self, folder):
+        """
+        Return the pages of ``folder`` in natural order, updating the index if needed.
+
+        :param folder: a directory or an archive file
+        :return: list of Page
+        """
+        folder = os.path.abspath(folder)
+        mtime = os.stat(folder).st_mtime_ns
+        with self._lock:
+            row = self._db.execute("SELECT mtime FROM folders WHERE path = ?", (folder,)).fetchone()
+            if row is not None and row[0] == mtime:
+                rows = self._db.execute(
+                    "SELECT name, width, height FROM pages WHERE folder = ?", (folder,)).fetchall()
+            else:
+                rows = self._rescan(folder, mtime)
+        rows.sort(key=lambda r: natural_key(r[0]))
+        if archive.is_archive(folder):
+            return [Page(archive.member_path(folder, name), width, height) for name, width, height in rows]
+        return [Page(os.path.join(folder, name), width, height) for name, width, height in rows]
+
+    @staticmethod
+    def _listing(folder, mtime):
+        """(name, size, mtime_ns, path) of every image in a folder or an archive."""
+        if archive.is_archive(folder):
+            opened = archive.registry.open(folder)
+            return [(name, opened.size(name), mtime, archive.member_path(folder, name))
+                    for name in opened.names() if is_image(name)]
+        listing = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if is_image(entry.name) and entry.is_file():
+                    st = entry.stat()
+                    listing.append((entry.name, st.st_size, st.st_mtime_ns, entry.path))
+        return listing
+
+    def _rescan(self, folder, mtime):
+        self.scans += 1
+        known = {name: (size, file_mtime, width, height) for name, size, file_mtime, width, height in
+                 self._db.execute("SELECT name, size, mtime, width, height FROM pages WHERE folder = ?",
+                                  (folder,))}
+        rows = []
+        updates = []
+        for name, size, file_mtime, path in self._listing(folder, mtime):
+            old = known.pop(name, None)
+            if old is not None and old[:2] == (size, file_mtime):
+                width, height = old[2:]
+            else:
+                self.probes += 1
+                width, height = probe_size(path) or (0, 0)
+                updates.append((folder, name, size, file_mtime, width, height))
+            rows.append((name, width, height))
+        self._db.execute("BEGIN")
+        try:
+            self._db.executemany("DELETE FROM pages WHERE folder = ? AND name = ?",
+                                 [(folder, name) for name in known])
+            self._db.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)", updates)
+            settled = time.time_ns() - mtime > MTIME_SETTLE_NS
+            self._db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (folder, mtime if settled else -1))
+            self._db.execute("COMMIT")
+        except sqlite3.Error:
+            self._db.execute("ROLLBACK")
+            raise
+        return rows
+
+    def chapters(self, root):
+        """
+        Index every folder under ``root`` that directly contains images, and every archive.
+
+        ``root`` may be a single series or a whole library of series folders.
+        :return: list of (folder, pages) in natural order, folders depth-first
+        """
+        found = []
+        pending = [os.path.abspath(root)]
+        while pending:
+            folder = pending.pop()
+            if archive.is_archive(folder):
+                try:
+                    found.append((folder, self.chapter(folder)))
+                except (OSError, zipfile.BadZipFile) as exc:
+                    log.warning("跳过无法读取的压缩包 %s: %s", folder, exc)
+                continue
+            children = []
+            has_images = False
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir() or archive.is_archive(entry.name) and entry.is_file():
+                            children.append(entry.path)
+                        elif is_image(entry.name):
+                            has_images = True
+            except OSError:
+                continue
+            if has_images:
+                found.append((folder, self.chapter(folder)))
+            children.sort(key=lambda p: natural_key(os.path.basename(p)), reverse=True)
+            pending.extend(children)
+        return found
+
+    @staticmethod
+    def next_chapter(folder):
+        """
+        The sibling chapter that follows ``folder`` in natural order.
+
+        :return: the path of the next folder containing images, or archive, or None
+        """
+        folder = os.path.abspath(folder)
+        key = natural_key(os.path.basename(folder))
+        candidates = []
+        try:
+            with os.scandir(os.path.dirname(folder)) as entries:
+                for entry in entries:
+                    if natural_key(entry.name) <= key:
+                        continue
+                    if entry.is_dir() or archive.is_archive(entry.name) and entry.is_file():
+                        candidates.append(entry)
+        except OSError:
+            return None
+        candidates.sort(key=lambda e: natural_key(e.name))
+        for entry in candidates:
+            if not entry.is_dir():
+                return entry.path
+            try:
+                with os.scandir(entry.path) as files:
+                    if any(is_image(f.name) for f in files):
+                        return entry.path
+            except OSError:
+                continue
+        return None
+
+    def forget(self, folder):
+        """Drop a folder from the index (for example after it was deleted)."""
+        folder = os.path.abspath(folder)
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE folder = ?", (folder,))
+            self._db.execute("DELETE FROM folders WHERE path = ?", (folder,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+后台解码/处理线程池。
+
+图片的解码、去白边和缩放都在 QThreadPool 的工作线程中完成，GUI 线程只负责
+把处理好的 QImage 放到界面上。等待中的任务按与当前阅读位置的距离排序，
+离开阅读范围的任务会被取消。
+"""
+import logging
+from collections import namedtuple
+
+from PyQt5.QtCore import (QBuffer, QByteArray, QIODevice, QObject, QRunnable, QSize, QThread,
+                          QThreadPool, Qt, pyqtSignal)
+from PyQt5.QtGui import QImageReader
+
+import archive
+import perftrace
+import preprocess
+import tiles
+from plancache import file_signature
+from qtimage import qimage_view, render_plan, rgb_to_qimage, rgb_view
+
+log = logging.getLogger(__name__)
+
+# A display-ready page produced by a worker.
+#   image: processed (cropped, gaps removed) QImage at decode resolution,
+#          None for tall pages, which are delivered tile by tile
+#   scaled: ``image`` scaled to ``width``
+#   scale: decode reduction factor the plan and image were made at (1 = full resolution)
+PageResult = namedtuple("PageResult", ["index", "path", "image", "scaled", "width", "plan", "scale"])
+
+# One tile of a tall page; ``scaled`` fills the tile's display band at ``width``.
+TileResult = namedtuple("TileResult", ["index", "tile", "image", "scaled", "width"])
+
+# A cached original (page or tile) rescaled for a new viewport width.
+ScaleResult = namedtuple("ScaleResult", ["index", "tile", "scaled", "width"])
+
+
+# Reduction factors tried when decoding, largest first. JPEG decodes these
+# directly through DCT scaling; other formats are scaled right after decoding.
+DECODE_SCALES = (8, 4, 2)
+
+
+def decode_scale(src_width, target_width):
+    """Largest reduction factor that still leaves at least ``target_width`` columns."""
+    if target_width > 0:
+        for scale in DECODE_SCALES:
+            if src_width // scale >= target_width:
+                return scale
+    return 1
+
+
+def image_reader(path):
+    """A QImageReader for ``path``; archive members are decoded from their bytes in memory."""
+    if archive.split_path(path) is None:
+        return QImageReader(path)
+    with perftrace.span("archive_read"):
+        data = archive.registry.read(path)
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    reader.buffer = buffer  # A reader does not own its device.
+    return reader
+
+
+def read_image(path, scale=1, reader=None):
+    """
+    Decode ``path`` reduced by ``scale`` (1 = full resolution).
+
+    The reduced size is rounded up like libjpeg's DCT scaling, so JPEGs need no
+    resampling after decoding.
+    """
+    with perftrace.span("decode", scale=scale):
+        if reader is None:
+            reader = image_reader(path)
+        if scale > 1:
+            size = reader.size()
+            if size.isValid():
+                reader.setScaledSize(QSize(-(-size.width() // scale), -(-size.height() // scale)))
+        return reader.read()
+
+
+def analysis_params(params, scale):
+    """Preprocessing parameters for an image decoded ``scale`` times smaller (gap heights are in rows)."""
+    if scale == 1:
+        return params
+    return dict(params, min_gap_height=max(1, round(params["min_gap_height"] / scale)))
+
+
+def scale_to_width(image, width):
+    """Smooth-scale a QImage to exactly the given width, keeping the aspect ratio."""
+    if width <= 0 or image.width() == width:
+        return image
+    height = max(1, int(image.height() * width / image.width()))
+    with perftrace.span("scale"):
+        return image.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def scale_tile(image, plan, tile, width):
+    """Smooth-scale a tile of ``plan`` so it exactly fills its display band at ``width``."""
+    a, b = tiles.display_band(plan.width, plan.height, width, tile)
+    with perftrace.span("scale"):
+        return image.scaled(width, max(1, b - a), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def process_page(path, params, target_width, cache=None, tile_store=None, cancelled=None):
+    """
+    Decode, analyse and render one page (shared by PageJob and the chapter pack builder).
+
+    The page is decoded at the largest reduction that still leaves
+    ``target_width`` columns (0 = full resolution). If the cropped content
+    turns out narrower than that, it is decoded again at the factor its real
+    width allows. Plans are cached under the requested factor and record the
+    resolution that was really used.
+
+    :param tile_store: if given, tall pages are spilled to it instead of rendered
+    :param cancelled: optional callable; once it returns True the work stops
+    :return: (processed QImage, plan, scale), the image being None for a spilled
+             tall page; None if the page could not be decoded or was cancelled
+    """
+    cancelled = cancelled or (lambda: False)
+    if cancelled():
+        return None
+    signature = file_signature(path)
+    reader = image_reader(path)
+    size = reader.size()
+    scale = decode_scale(size.width(), target_width) if size.isValid() else 1
+    # Plans depend on the decode resolution, so the requested scale is part of the key.
+    cache_params = dict(params, decode_scale=scale)
+    cached = None
+    if cache is not None:
+        cached = cache.get(path, signature, cache_params)
+        if cached is not None and scale > 1:
+            used = max(1, round(size.width() / max(1, cached.src_width)))
+            if used > 1 and cached.width < target_width:
+                cached = None  # Too narrow for the screen; analyse (and re-decode) again.
+            else:
+                scale = used
+    spill = None
+    if tile_store is not None:
+        spill = tile_store.name(path, signature, params)
+        # A tall page whose rows are already spilled needs no decoding at all.
+        if cached is not None and tiles.is_tall(cached.height) and tile_store.open(spill, cached) is not None:
+            return None, cached, scale
+
+    image = read_image(path, scale, reader)
+    if image.isNull() or cancelled():
+        return None
+    arr, view_image = qimage_view(image)
+    plan = cached
+    if plan is None or (plan.src_width, plan.src_height) != (image.width(), image.height()):
+        with perftrace.span("analyze"):
+            plan = preprocess.analyze(arr, **analysis_params(params, scale))
+        if scale > 1 and plan.width < target_width:
+            # The cropped content is too narrow at this scale: decode again
+            # at the scale its real width allows.
+            scale = decode_scale(size.width() * plan.width // plan.src_width, target_width)
+            image = read_image(path, scale)
+            if image.isNull() or cancelled():
+                return None
+            arr, view_image = qimage_view(image)
+            with perftrace.span("analyze"):
+                plan = preprocess.analyze(arr, **analysis_params(params, scale))
+        if cache is not None:
+            cache.put(path, signature, cache_params, plan)
+    if cancelled():
+        return None
+
+    if spill is not None and tiles.is_tall(plan.height):
+        with perftrace.span("spill"):
+            tile_store.write(spill, rgb_view(arr, view_image.format()), plan)
+        return None, plan, scale
+    with perftrace.span("render"):
+        processed = render_plan(arr, plan, view_image.format())
+    return processed, plan, scale
+
+
+class LoaderJob(QRunnable):
+    """Base class of the jobs run by PageLoader; ``key`` is (index, tile or None)."""
+
+    def __init__(self, loader, index, tile, path, width):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.loader = loader
+        self.index = index
+        self.tile = tile
+        self.key = (index, tile)
+        self.path = path
+        self.width = width
+        self.cancelled = False
+
+    def run(self):
+        result = None
+        try:
+            with perftrace.span(type(self).__name__, index=self.index, tile=self.tile):
+                result = self.process()
+        except Exception as exc:  # Never let an exception escape into Qt.
+            log.warning("处理图片失败 %s: %s", self.path, exc)
+        self.loader._job_done.emit(self, result)
+
+    def process(self):
+        raise NotImplementedError
+
+    def ready(self, result):
+        """Deliver ``result`` (called on the GUI thread)."""
+        raise NotImplementedError
+
+    def failed(self):
+        """Report that ``process`` returned nothing (called on the GUI thread)."""
+
+
+class PageJob(LoaderJob):
+    """Decode, process and scale one page on a worker thread."""
+
+    def __init__(self, loader, index, path, width):
+        super().__init__(loader, index, None, path, width)
+        self.params = dict(loader.params)
+        self.cache = loader.cache
+        self.tile_store = loader.tile_store
+        # Columns needed on screen in device pixels; 0 decodes at full resolution.
+        self.target_width = int(width * loader.pixel_ratio) if loader.reduced_decode else 0
+
+    def process(self):
+        result = process_page(self.path, self.params, self.target_width, self.cache, self.tile_store,
+                              cancelled=lambda: self.cancelled)
+        if result is None:
+            return None
+        processed, plan, scale = result
+        if processed is None:
+            return PageResult(self.index, self.path, None, None, self.width, plan, scale)
+        scaled = scale_to_width(processed, self.width)
+        return PageResult(self.index, self.path, processed, scaled, self.width, plan, scale)
+
+    def ready(self, result):
+        self.loader.page_ready.emit(result)
+
+    def failed(self):
+        self.loader.page_failed.emit(self.index)
+
+
+class TileJob(LoaderJob):
+    """Read one tile of a spilled tall page and scale it."""
+
+    def __init__(self, loader, index, tile, path, width, plan):
+        super().__init__(loader, index, tile, path, width)
+        self.plan = plan
+        self.params = dict(loader.params)
+        self.tile_store = loader.tile_store
+
+    def process(self):
+        if self.cancelled:
+            return None
+        spill = self.tile_store.name(self.path, file_signature(self.path), self.params)
+        rows = self.tile_store.open(spill, self.plan)
+        if rows is None:
+            return None
+        y0, y1 = tiles.tile_rows(self.plan.height, self.tile)
+        with perftrace.span("tile_read"):
+            image = rgb_to_qimage(rows[y0:y1])
+        del rows
+        if self.cancelled:
+            return None
+        scaled = scale_tile(image, self.plan, self.tile, self.width)
+        return TileResult(self.index, self.tile, image, scaled, self.width)
+
+    def ready(self, result):
+        self.loader.tile_ready.emit(result)
+
+    def failed(self):
+        self.loader.tile_failed.emit(self.index, self.tile)
+
+
+class ScaleJob(LoaderJob):
+    """High-quality rescale of an already processed page or tile."""
+
+    def __init__(self, loader, index, tile, image, width, height):
+        super().__init__(loader, index, tile, "", width)
+        self.image = image
+        self.height = height
+
+    def process(self):
+        if self.cancelled:
+            return None
+        with perftrace.span("scale"):
+            scaled = self.image.scaled(self.width, self.height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return ScaleResult(self.index, self.tile, scaled, self.width)
+
+    def ready(self, result):
+        self.loader.scale_ready.emit(result)
+
+
+class PageLoader(QObject):
+    """
+    Priority-ordered page loader backed by a QThreadPool.
+
+    Only as many jobs as there are worker threads are handed to the pool; the
+    rest wait in ``_pending`` and the one closest to the focus page is started
+    next, so priorities always reflect the current scroll position.
+    Jobs are keyed by (index, tile); whole-page jobs use tile None.
+    """
+
+    page_ready = pyqtSignal(object)   # PageResult
+    page_failed = pyqtSignal(int)     # index
+    tile_ready = pyqtSignal(object)   # TileResult
+    tile_failed = pyqtSignal(int, int)  # index, tile
+    scale_ready = pyqtSignal(object)  # ScaleResult
+
+    _job_done = pyqtSignal(object, object)
+
+    def __init__(self, threads=0, cache=None, tile_store=None, parent=None):
+        super().__init__(parent)
+        self.cache = cache  # optional PlanCache shared by all workers
+        self.tile_store = tile_store  # optional TileStore for tall pages
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(threads if threads > 0 else QThread.idealThreadCount())
+        self.params = dict(
+            threshold=preprocess.DEFAULT_THRESHOLD,
+            white_ratio=preprocess.DEFAULT_WHITE_RATIO,
+            min_gap_height=preprocess.DEFAULT_MIN_GAP_HEIGHT,
+        )
+        # Decode pages only as large as the display needs (in device pixels).
+        self.reduced_decode = True
+        self.pixel_ratio = 1.0
+        self.focus = (0, 0)
+        self._pending = {}  # key -> LoaderJob waiting for a worker
+        self._running = {}  # key -> LoaderJob being processed
+        self._draining = set()  # cancelled jobs still occupying a worker
+        self._job_done.connect(self._on_job_done)
+
+    def thread_count(self):
+        return self.pool.maxThreadCount()
+
+    def is_requested(self, index, tile=None):
+        key = (index, tile)
+        return key in self._pending or key in self._running
+
+    def _submit(self, job):
+        if job.key in self._pending or job.key in self._running:
+            return
+        self._pending[job.key] = job
+        self._pump()
+
+    def request(self, index, path, width):
+        """Queue a page unless it is already queued or being processed."""
+        if not self.is_requested(index):
+            self._submit(PageJob(self, index, path, width))
+
+    def request_tile(self, index, tile, path, width, plan):
+        """Queue one tile of a tall page whose rows have been spilled."""
+        if not self.is_requested(index, tile):
+            self._submit(TileJob(self, index, tile, path, width, plan))
+
+    def request_scale(self, index, tile, image, width, height):
+        """
+        Queue a smooth rescale of ``image`` (page or tile) to width x height.
+
+        A queued rescale for another width is replaced; a page or tile job
+        already producing this key is left alone, its result is rescaled later.
+        """
+        job = self._pending.get((index, tile)) or self._running.get((index, tile))
+        if job is not None:
+            if job.width == width or not isinstance(job, ScaleJob):
+                return
+            self.cancel(job.key)
+        self._submit(ScaleJob(self, index, tile, image, width, height))
+
+    def cancel_stale_scales(self, width):
+        """Cancel rescales made for any width other than ``width``."""
+        self.cancel_if(lambda job: isinstance(job, ScaleJob) and job.width != width)
+
+    def set_focus(self, index, tile=0):
+        """Set the page (and tile) the reader is looking at; pending jobs are ordered by distance to it."""
+        self.focus = (index, tile)
+
+    def cancel(self, key):
+        job = self._pending.pop(key, None)
+        if job is None:
+            job = self._running.pop(key, None)
+            if job is None:
+                return
+            self._draining.add(job)
+        job.cancelled = True
+
+    def cancel_if(self, predicate):
+        """Cancel every queued or running job for which ``predicate(job)`` is true."""
+        for job in list(self._pending.values()) + list(self._running.values()):
+            if predicate(job):
+                self.cancel(job.key)
+
+    def cancel_outside(self, first, last):
+        """Cancel every job whose index is not within [first, last]."""
+        self.cancel_if(lambda job: job.index < first or job.index > last)
+
+    def cancel_all(self):
+        self.cancel_if(lambda job: True)
+
+    def shutdown(self):
+        """Cancel all work and wait for the running jobs to return."""
+        self.cancel_all()
+        self.pool.waitForDone()
+
+    def _priority(self, key):
+        # Nearest page first; on a tie prefer the page below (reading direction).
+        # Tiles of the same page are ordered by distance to the focus tile.
+        index, tile = key
+        focus_index, focus_tile = self.focus
+        if index == focus_index:
+            return 0, False, abs((tile or 0) - focus_tile)
+        tile = tile or 0
+        return abs(index - focus_index), index < focus_index, -tile if index < focus_index else tile
+
+    def _pump(self):
+        while self._pending and len(self._running) + len(self._draining) < self.pool.maxThreadCount():
+            key = min(self._pending, key=self._priority)
+            job = self._pending.pop(key)
+            self._running[key] = job
+            self.pool.start(job)
+
+    def _on_job_done(self, job, result):
+        if self._running.get(job.key) is job:
+            del self._running[job.key]
+        self._draining.discard(job)
+        if not job.cancelled:
+            if result is None:
+                job.failed()
+            else:
+                job.ready(result)
+        self._pump()
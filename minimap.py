@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""画面右侧的缩略图导航栏：显示整章的缩略图，点击跳到对应的页。"""
+from PyQt5.QtCore import QEvent, QRect, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPen
+from PyQt5.QtWidgets import QAbstractScrollArea
+
+from thumbnails import THUMB_HEIGHT, THUMB_WIDTH, cell_origin
+
+MARGIN = 4
+CELL_HEIGHT = THUMB_HEIGHT + MARGIN
+
+
+class Minimap(QAbstractScrollArea):
+    """
+    Vertical strip of thumbnails drawn from the builder's atlas, docked to the right edge of its parent.
+
+    Pages the canvas is showing are outlined; only the visible cells are painted.
+    """
+
+    page_clicked = pyqtSignal(int)  # index
+
+    def __init__(self, parent, builder):
+        super().__init__(parent)
+        self.builder = builder
+        self.count = 0
+        self.current = (0, -1)  # First and last page on screen
+        self.background = QColor(20, 20, 20, 220)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setFrameShape(QAbstractScrollArea.NoFrame)
+        self.verticalScrollBar().setSingleStep(CELL_HEIGHT // 2)
+        self.setFixedWidth(THUMB_WIDTH + 2 * MARGIN + self.verticalScrollBar().sizeHint().width())
+        builder.opened.connect(self.viewport().update)
+        builder.thumbnail_ready.connect(self._on_thumbnail_ready)
+        parent.installEventFilter(self)
+        self.hide()
+
+    def set_count(self, count):
+        self.count = count
+        self.current = (0, -1)
+        self._update_range()
+        self.verticalScrollBar().setValue(0)
+        self.viewport().update()
+
+    def set_current(self, first, last):
+        """Outline pages first..last and scroll them into view."""
+        if (first, last) == self.current:
+            return
+        self.current = (first, last)
+        bar = self.verticalScrollBar()
+        top = first * CELL_HEIGHT
+        if top < bar.value() or top + CELL_HEIGHT > bar.value() + self.viewport().height():
+            bar.setValue(top - (self.viewport().height() - CELL_HEIGHT) // 2)
+        self.viewport().update()
+
+    def index_at(self, y):
+        index = (y + self.verticalScrollBar().value()) // CELL_HEIGHT
+        return index if 0 <= index < self.count else None
+
+    def _update_range(self):
+        bar = self.verticalScrollBar()
+        bar.setPageStep(self.viewport().height())
+        bar.setRange(0, max(0, self.count * CELL_HEIGHT + MARGIN - self.viewport().height()))
+
+    def _on_thumbnail_ready(self, index):
+        if self.isVisible():
+            top = index * CELL_HEIGHT - self.verticalScrollBar().value()
+            if top + CELL_HEIGHT > 0 and top < self.viewport().height():
+                self.viewport().update()
+
+    def eventFilter(self, watched, event):
+        if watched is self.parent() and event.type() == QEvent.Resize:
+            self.setGeometry(watched.width() - self.width(), 0, self.width(), watched.height())
+        return False
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._update_range()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            index = self.index_at(event.pos().y())
+            if index is not None:
+                self.page_clicked.emit(index)
+        event.accept()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.fillRect(event.rect(), self.background)
+        atlas = self.builder.atlas
+        value = self.verticalScrollBar().value()
+        first = max(0, value // CELL_HEIGHT)
+        last = min(self.count - 1, (value + self.viewport().height()) // CELL_HEIGHT)
+        for i in range(first, last + 1):
+            target = QRect(MARGIN, i * CELL_HEIGHT + MARGIN - value, THUMB_WIDTH, THUMB_HEIGHT)
+            if atlas is not None and i in atlas.done:
+                x, y = cell_origin(i)
+                painter.drawImage(target, atlas.image, QRect(x, y, THUMB_WIDTH, THUMB_HEIGHT))
+            painter.setPen(QColor(200, 200, 200))
+            painter.drawText(target.adjusted(0, 0, -3, -2), Qt.AlignRight | Qt.AlignBottom, str(i + 1))
+            if self.current[0] <= i <= self.current[1]:
+                painter.setPen(QPen(QColor(80, 160, 255), 2))
+                painter.drawRect(target.adjusted(1, 1, -1, -1))
+        painter.end()
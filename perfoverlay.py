@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""画面左上角的性能面板：帧间隔、各阶段耗时和缓存状态。"""
+import numpy as np
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QLabel
+
+from perftrace import tracer
+
+REFRESH_MS = 500   # Panel update interval
+WINDOW_S = 2.0     # Statistics cover the events of the last WINDOW_S seconds
+
+
+class PerfOverlay(QLabel):
+    """
+    Semi-transparent text panel drawn over the canvas.
+
+    Statistics come from perftrace.tracer; ``extra_lines()`` may return more
+    lines (cache state) to append below them.
+    """
+
+    def __init__(self, parent, extra_lines=None):
+        super().__init__(parent)
+        self.extra_lines = extra_lines or (lambda: [])
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.setStyleSheet("background: rgba(0, 0, 0, 170); color: #e0e0e0; padding: 6px;"
+                           " font-family: monospace;")
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def set_active(self, active):
+        if active:
+            self.refresh()
+            self.show()
+            self.timer.start()
+        else:
+            self.timer.stop()
+            self.hide()
+
+    def frame_line(self, events):
+        starts = [start for name, start, _, _, _ in events if name == "paint"]
+        if len(starts) < 2:
+            return "帧间隔：—"
+        intervals = np.diff(starts) / 1e6
+        return "帧间隔：平均 {:.1f} ms，最大 {:.1f} ms，{:.0f} 帧/秒".format(
+            intervals.mean(), intervals.max(), len(starts) / WINDOW_S)
+
+    def refresh(self):
+        events = tracer.recent(WINDOW_S)
+        lines = [self.frame_line(events), ""]
+        for name, st in tracer.stage_stats(events).items():
+            lines.append("{:<18} {:4d} 次  平均 {:6.1f}  p90 {:6.1f}  最大 {:6.1f} ms".format(
+                name, st["count"], st["mean_ms"], st["p90_ms"], st["max_ms"]))
+        extra = self.extra_lines()
+        if extra:
+            lines.append("")
+            lines.extend(extra)
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.move(8, 8)
+        self.raise_()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+各处理阶段的耗时记录。
+
+代码中用 ``with perftrace.span("decode"):`` 标出一个阶段；记录关闭时 span 返回
+一个共享的空对象，几乎没有开销。打开后每个阶段的开始时间、耗时和线程保存在
+固定长度的环形缓冲中，可以导出为 Chrome trace（chrome://tracing、Perfetto）
+JSON 或按阶段汇总的 CSV。本模块不依赖 Qt。
+"""
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+DEFAULT_CAPACITY = 200000  # Events kept in the ring buffer
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Thread-safe recorder of timed stages.
+
+    Events are (name, start_ns, duration_ns, thread id, args) tuples;
+    deque.append is atomic, so worker threads record without a lock.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.enabled = False
+        self.events = deque(maxlen=capacity)
+        self.thread_names = {}
+        self.origin = time.perf_counter_ns()
+
+    def span(self, name, **args):
+        """Context manager timing one stage; a no-op while the tracer is disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start_ns, duration_ns, args=None):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        self.events.append((name, start_ns, duration_ns, tid, args))
+
+    def clear(self):
+        self.events.clear()
+
+    def recent(self, seconds):
+        """Events that started within the last ``seconds``, oldest first."""
+        since = time.perf_counter_ns() - int(seconds * 1e9)
+        found = []
+        for event in reversed(list(self.events)):
+            if event[1] < since:
+                break
+            found.append(event)
+        found.reverse()
+        return found
+
+    @staticmethod
+    def stage_stats(events):
+        """Per-stage count and latency statistics (milliseconds) of ``events``."""
+        durations = {}
+        for name, _, duration, _, _ in events:
+            durations.setdefault(name, []).append(duration)
+        stats = {}
+        for name, values in sorted(durations.items()):
+            ms = np.asarray(values, dtype=np.float64) / 1e6
+            p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+            stats[name] = dict(count=len(ms), total_ms=float(ms.sum()), mean_ms=float(ms.mean()),
+                               p50_ms=float(p50), p90_ms=float(p90), p99_ms=float(p99),
+                               max_ms=float(ms.max()))
+        return stats
+
+    def chrome_trace(self):
+        """The recorded events in the Chrome trace-event format."""
+        pid = os.getpid()
+        trace = [dict(name="thread_name", ph="M", pid=pid, tid=tid, args=dict(name=name))
+                 for tid, name in list(self.thread_names.items())]
+        for name, start, duration, tid, args in list(self.events):
+            event = dict(name=name, ph="X", pid=pid, tid=tid,
+                         ts=(start - self.origin) / 1000.0, dur=duration / 1000.0)
+            if args:
+                event["args"] = args
+            trace.append(event)
+        return dict(traceEvents=trace, displayTimeUnit="ms")
+
+    def export_chrome(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def export_csv(self, path):
+        """Write one row of statistics per stage."""
+        stats = self.stage_stats(list(self.events))
+        fields = ["count", "total_ms", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage"] + fields)
+            for name, st in stats.items():
+                writer.writerow([name] + [round(st[k], 3) if isinstance(st[k], float) else st[k] for k in fields])
+
+
+tracer = Tracer()
+span = tracer.span
+
+
+def traced(name):
+    """Decorator timing every call of a function as stage ``name``."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with _Span(tracer, name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+白边分析结果的磁盘缓存。
+
+每页的裁剪框、保留的行区间和最终尺寸按 (文件路径, 处理参数) 存入 SQLite，
+并记录文件大小和修改时间；文件变化后旧记录自动失效。记录数超过上限时
+按最近使用时间淘汰。
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import archive
+from preprocess import PagePlan
+
+DEFAULT_MAX_ENTRIES = 50000
+
+
+def file_signature(path):
+    """Return (size, mtime_ns) used to detect changed files (or archive members)."""
+    if archive.split_path(path) is not None:
+        return archive.registry.signature(path)
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def params_key(params):
+    """Stable text key for a dict of preprocessing parameters."""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+def encode_plan(plan):
+    return json.dumps([plan.src_width, plan.src_height, plan.crop, plan.rows, plan.width, plan.height,
+                       plan.head, plan.tail], separators=(",", ":"))
+
+
+def decode_plan(text):
+    """Return the stored PagePlan, or None for a record written before plans had head/tail."""
+    fields = json.loads(text)
+    if len(fields) != len(PagePlan._fields):
+        return None
+    src_width, src_height, crop, rows, width, height, head, tail = fields
+    return PagePlan(src_width, src_height, tuple(crop), tuple(tuple(r) for r in rows), width, height, head, tail)
+
+
+class PlanCache:
+    """
+    Thread-safe LRU cache of PagePlans stored in an SQLite file.
+
+    Worker threads share one connection guarded by a lock; every statement is
+    tiny, so contention is negligible compared to decoding.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plans ("
+            " path TEXT NOT NULL, params TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime INTEGER NOT NULL,"
+            " plan TEXT NOT NULL, last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (path, params))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_last_used ON plans (last_used)")
+        count, tick = self._db.execute("SELECT COUNT(*), MAX(last_used) FROM plans").fetchone()
+        self._count = count
+        self._tick = tick or 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, signature, params):
+        """
+        Return the cached PagePlan for ``path`` or None.
+
+        :param signature: (size, mtime_ns) of the file as it is now
+        :param params: preprocessing parameters used to build the plan
+        """
+        key = params_key(params)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime, plan FROM plans WHERE path = ? AND params = ?", (path, key)
+            ).fetchone()
+            plan = decode_plan(row[2]) if row is not None else None
+            if plan is None:
+                self.misses += 1
+                return None
+            if (row[0], row[1]) != tuple(signature):
+                # The file changed since the plan was stored.
+                self._db.execute("DELETE FROM plans WHERE path = ? AND params = ?", (path, key))
+                self._count -= 1
+                self.misses += 1
+                return None
+            self._tick += 1
+            self._db.execute(
+                "UPDATE plans SET last_used = ? WHERE path = ? AND params = ?", (self._tick, path, key)
+            )
+            self.hits += 1
+        return plan
+
+    def peek(self, path, signature, params):
+        """Like ``get`` but does not touch the LRU order or the statistics."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime, plan FROM plans WHERE path = ? AND params = ?", (path, params_key(params))
+            ).fetchone()
+        if row is None or (row[0], row[1]) != tuple(signature):
+            return None
+        return decode_plan(row[2])
+
+    def put(self, path, signature, params, plan):
+        key = params_key(params)
+        with self._lock:
+            self._tick += 1
+            cur = self._db.execute(
+                "UPDATE plans SET size = ?, mtime = ?, plan = ?, last_used = ? WHERE path = ? AND params = ?",
+                (signature[0], signature[1], encode_plan(plan), self._tick, path, key),
+            )
+            if cur.rowcount == 0:
+                self._db.execute(
+                    "INSERT INTO plans (path, params, size, mtime, plan, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, key, signature[0], signature[1], encode_plan(plan), self._tick),
+                )
+                self._count += 1
+                if self._count > self.max_entries:
+                    self._evict()
+
+    def _evict(self):
+        # Drop the least recently used tenth so eviction does not run on every insert.
+        excess = self._count - self.max_entries + max(1, self.max_entries // 10)
+        self._db.execute(
+            "DELETE FROM plans WHERE rowid IN (SELECT rowid FROM plans ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._count = self._db.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM plans")
+            self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
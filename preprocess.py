@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+白边分析引擎。
+
+整页图像只转换成一次数组，然后由同一个白色掩码得到行/列白色分布，
+同时算出外围裁剪框和需要去掉的内部空白行，最后按分析结果一次切片输出。
+本模块只依赖 NumPy，不依赖 Qt，可以在子进程中使用。
+"""
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 240
+DEFAULT_WHITE_RATIO = 0.98
+DEFAULT_MIN_GAP_HEIGHT = 100
+DEFAULT_KEEP_GAP_HEIGHT = 0
+
+# Result of analysing one page.
+#   src_width / src_height: size of the analysed array
+#   crop: (x0, y0, x1, y1), half-open column/row bounds of the outer content box
+#   rows: tuple of (start, stop) row ranges to keep, in source coordinates
+#   width / height: size of the output image
+#   head / tail: white rows (by white_ratio) at the top and bottom of the output;
+#                they equal ``height`` for a page that is white throughout
+PagePlan = namedtuple("PagePlan", ["src_width", "src_height", "crop", "rows", "width", "height", "head", "tail"],
+                      defaults=(0, 0))
+
+
+def identity_plan(width, height):
+    """Return a plan that keeps the whole image unchanged."""
+    return PagePlan(width, height, (0, 0, width, height), ((0, height),), width, height)
+
+
+def white_mask(arr, threshold=DEFAULT_THRESHOLD):
+    """
+    Return a boolean (h, w) mask of white-ish pixels.
+
+    A pixel is white-ish if all of its colour channels are >= threshold.
+    ``arr`` may be a single-channel (h, w) array or an (h, w, c) array whose
+    first three channels are colour; the alpha channel is ignored.
+    """
+    if arr.ndim == 2:
+        return arr >= threshold
+    lowest = np.minimum(np.minimum(arr[..., 0], arr[..., 1]), arr[..., 2])
+    return lowest >= threshold
+
+
+def white_row_flags(arr, threshold=DEFAULT_THRESHOLD, white_ratio=DEFAULT_WHITE_RATIO):
+    """Return a 1-D bool array telling which rows of ``arr`` count as white."""
+    if arr.shape[1] == 0:
+        return np.ones(arr.shape[0], dtype=bool)
+    return np.count_nonzero(white_mask(arr, threshold), axis=1) / arr.shape[1] >= white_ratio
+
+
+def white_runs(flags):
+    """Return an (n, 2) array of (start, stop) bounds of the True runs in a 1-D bool array."""
+    padded = np.concatenate(([False], flags, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges.reshape(-1, 2)
+
+
+def edge_runs(flags):
+    """Return the lengths of the True runs at the start and the end of a 1-D bool array."""
+    if not flags.all():
+        false = np.flatnonzero(~flags)
+        return int(false[0]), int(len(flags) - 1 - false[-1])
+    return len(flags), len(flags)
+
+
+def content_box(row_counts, col_counts, width, height):
+    """
+    Find the outer box that contains every non-white pixel.
+
+    :param row_counts: number of white pixels in each row
+    :param col_counts: number of white pixels in each column
+    :return: (x0, y0, x1, y1) or None if the image is entirely white
+    """
+    rows = np.flatnonzero(row_counts < width)
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(col_counts < height)
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def kept_rows(white_rows, min_gap_height):
+    """
+    Return the row ranges that survive internal gap removal.
+
+    A run of white rows is removed only when it does not touch the top or the
+    bottom edge and is at least ``min_gap_height`` rows tall.
+    """
+    height = len(white_rows)
+    keep = []
+    pos = 0
+    for start, stop in white_runs(white_rows):
+        if start > 0 and stop < height and stop - start >= min_gap_height:
+            if start > pos:
+                keep.append((pos, int(start)))
+            pos = int(stop)
+    if pos < height:
+        keep.append((pos, height))
+    return keep
+
+
+def analyze(arr, threshold=DEFAULT_THRESHOLD, white_ratio=DEFAULT_WHITE_RATIO,
+            min_gap_height=DEFAULT_MIN_GAP_HEIGHT, crop=True):
+    """
+    Analyse a page: crop the outer white border, then drop internal white gaps.
+
+    Produces the same result as ``crop_white_border`` followed by
+    ``remove_internal_white_gap`` but scans the pixels only once.
+
+    :param arr: (h, w) or (h, w, c) uint8 array
+    :param crop: if False, skip the outer border crop
+    :return: PagePlan
+    """
+    height, width = arr.shape[:2]
+    if height == 0 or width == 0:
+        return identity_plan(width, height)
+    mask = white_mask(arr, threshold)
+    row_counts = np.count_nonzero(mask, axis=1)
+
+    box = None
+    if crop:
+        box = content_box(row_counts, np.count_nonzero(mask, axis=0), width, height)
+    if box is None:
+        box = (0, 0, width, height)
+    x0, y0, x1, y1 = box
+
+    # Row profile of the cropped region; reuse the full-width one when possible.
+    if x0 == 0 and x1 == width:
+        sub_counts = row_counts[y0:y1]
+    else:
+        sub_counts = np.count_nonzero(mask[y0:y1, x0:x1], axis=1)
+    white_rows = sub_counts / (x1 - x0) >= white_ratio
+
+    rows = tuple((y0 + a, y0 + b) for a, b in kept_rows(white_rows, min_gap_height))
+    out_height = sum(b - a for a, b in rows)
+    # Edge runs are never removed above, so they reach the output unchanged.
+    head, tail = edge_runs(white_rows)
+    return PagePlan(width, height, box, rows, x1 - x0, out_height, head, tail)
+
+
+def analyze_collapse(arr, threshold=DEFAULT_THRESHOLD, white_ratio=DEFAULT_WHITE_RATIO):
+    """
+    Plan for ``collapse_white_gaps``: trim to the span of non-white rows and columns.
+
+    Rows whose white fraction is >= white_ratio are treated as white; columns are
+    judged only on the remaining rows.
+    """
+    height, width = arr.shape[:2]
+    mask = white_mask(arr, threshold)
+    rows_to_keep = np.flatnonzero(np.count_nonzero(mask, axis=1) / width < white_ratio)
+    if rows_to_keep.size == 0:
+        return identity_plan(width, height)
+    col_counts = np.count_nonzero(mask[rows_to_keep], axis=0)
+    cols_to_keep = np.flatnonzero(col_counts / rows_to_keep.size < white_ratio)
+    if cols_to_keep.size == 0:
+        return identity_plan(width, height)
+    y0, y1 = int(rows_to_keep[0]), int(rows_to_keep[-1]) + 1
+    x0, x1 = int(cols_to_keep[0]), int(cols_to_keep[-1]) + 1
+    return PagePlan(width, height, (x0, y0, x1, y1), ((y0, y1),), x1 - x0, y1 - y0)
+
+
+def plan_segments(plan, y0, y1):
+    """
+    Map output rows [y0, y1) of ``plan`` back to source row ranges.
+
+    :return: list of (start, stop) source row ranges, in output order
+    """
+    segments = []
+    pos = 0
+    for start, stop in plan.rows:
+        length = stop - start
+        a, b = max(y0, pos), min(y1, pos + length)
+        if a < b:
+            segments.append((start + a - pos, start + b - pos))
+        pos += length
+        if pos >= y1:
+            break
+    return segments
+
+
+def apply_plan(arr, plan, out=None, band=None):
+    """
+    Cut the kept region out of ``arr`` in a single copy.
+
+    :param out: optional pre-allocated output array to fill
+    :param band: optional (y0, y1) range of output rows to produce instead of the whole page
+    :return: the output array
+    """
+    x0, _, x1, _ = plan.crop
+    y0, y1 = band if band is not None else (0, plan.height)
+    if out is None:
+        out = np.empty((y1 - y0, plan.width) + arr.shape[2:], dtype=arr.dtype)
+    y = 0
+    for start, stop in plan_segments(plan, y0, y1):
+        out[y:y + stop - start] = arr[start:stop, x0:x1]
+        y += stop - start
+    return out
+
+
+def collapsed_gap(run, min_gap_height, keep_height):
+    """Rows left of a white run of ``run`` rows: runs of at least ``min_gap_height`` keep at most ``keep_height``."""
+    return run if run < min_gap_height else min(run, keep_height)
+
+
+def seam_trims(edges, min_gap_height=DEFAULT_MIN_GAP_HEIGHT, keep_height=DEFAULT_KEEP_GAP_HEIGHT):
+    """
+    Collapse the white gaps that cross page boundaries in a sequence of pages.
+
+    Applies the GapCollapser rule to each seam without touching pixels: the
+    white tail of one page, any pages that are white throughout (or empty), and
+    the white head of the next page form one run. Pages without rows at the
+    start and end of the sequence are ignored, so they do not form seams of
+    their own. Rows can only be hidden at page edges: whole segments of
+    the run are kept from its start, and the segment that is cut short keeps
+    the rows next to the page's content.
+
+    :param edges: [(height, head, tail)] per page, all in rows of the same scale
+    :return: [(top, bottom)] rows to hide at the top and bottom of each page
+    """
+    trims = [[0, 0] for _ in edges]
+    filled = [i for i, (height, _, _) in enumerate(edges) if height > 0]
+    if not filled:
+        return [tuple(trim) for trim in trims]
+    i, last = filled[0], filled[-1]
+    while i < last:
+        segments = [(i, edges[i][2])]
+        j = i + 1
+        while j < last and edges[j][1] >= edges[j][0]:
+            segments.append((j, edges[j][0]))
+            j += 1
+        segments.append((j, min(edges[j][1], edges[j][0])))
+        run = sum(length for _, length in segments)
+        keep = collapsed_gap(run, min_gap_height, keep_height)
+        if keep < run:
+            for k, (page, length) in enumerate(segments):
+                kept = min(length, keep)
+                keep -= kept
+                if k == 0:
+                    trims[page][1] = length - kept
+                else:
+                    trims[page][0] = length - kept
+        i = j
+    return [tuple(trim) for trim in trims]
+
+
+class GapCollapser:
+    """
+    Collapse white gaps in a continuous stream of rows, across page boundaries.
+
+    Pages are pushed one after another as (h, w[, c]) arrays of the same width.
+    A white run at the bottom of one page and the top of the next is treated as
+    a single gap. Only the trailing white run is carried between pushes, and at
+    most ``max(min_gap_height, keep_height)`` of its rows are buffered, so
+    memory does not depend on the length of the gap.
+
+    Every white run of at least ``min_gap_height`` rows, including runs at the
+    start and end of the stream, is shortened to at most ``keep_height`` rows
+    (0 removes it). Shorter runs are kept unchanged.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, white_ratio=DEFAULT_WHITE_RATIO,
+                 min_gap_height=DEFAULT_MIN_GAP_HEIGHT, keep_height=DEFAULT_KEEP_GAP_HEIGHT):
+        self.threshold = threshold
+        self.white_ratio = white_ratio
+        self.min_gap_height = max(1, min_gap_height)
+        self.keep_height = max(0, keep_height)
+        self.rows_in = 0
+        self.rows_out = 0
+        self._limit = max(self.min_gap_height, self.keep_height)
+        self._shape = None      # Row shape (w[, c]) of the stream
+        self._run = 0           # Length of the pending white run
+        self._buffer = []       # Copies of the first rows of the pending run
+        self._buffered = 0
+
+    def push(self, arr):
+        """
+        Add the rows of the next page.
+
+        :return: list of row arrays ready for output, in order; they may be
+                 views of ``arr``
+        """
+        if self._shape is None:
+            self._shape = arr.shape[1:]
+        elif arr.shape[1:] != self._shape:
+            raise ValueError(f"行形状不一致：{arr.shape[1:]} != {self._shape}")
+        self.rows_in += len(arr)
+        out = []
+        pos = 0
+        for start, stop in white_runs(white_row_flags(arr, self.threshold, self.white_ratio)):
+            if start > pos:
+                self._end_run(out)
+                out.append(arr[pos:start])
+            self._extend_run(arr[start:stop])
+            pos = int(stop)
+        if pos < len(arr):
+            self._end_run(out)
+            out.append(arr[pos:])
+        self.rows_out += sum(len(a) for a in out)
+        return out
+
+    def finish(self):
+        """Flush the white run left at the end of the stream."""
+        out = []
+        self._end_run(out)
+        self.rows_out += sum(len(a) for a in out)
+        return out
+
+    def _extend_run(self, rows):
+        self._run += len(rows)
+        room = self._limit - self._buffered
+        if room > 0:
+            self._buffer.append(rows[:room].copy())
+            self._buffered += min(room, len(rows))
+
+    def _end_run(self, out):
+        if not self._run:
+            return
+        keep = collapsed_gap(self._run, self.min_gap_height, self.keep_height)
+        for rows in self._buffer:
+            if keep <= 0:
+                break
+            out.append(rows[:keep])
+            keep -= len(rows)
+        self._run = 0
+        self._buffer = []
+        self._buffered = 0
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+阅读进度。
+
+每个文件夹记录视口顶部所在的图片和在这张图片中的位置（占图片高度的比例，
+与窗口宽度无关）。滚动时只更新内存中的记录，由调用方定时调用 ``flush``
+在一个事务中写入 SQLite，进程崩溃时数据库不会损坏，最多丢失最后一次写入
+之后的进度。打开文件夹只需按主键查询一次，历史记录再多也不影响启动速度。
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# Reading position in one folder.
+#   page: index of the page at the top of the viewport
+#   offset: position of the viewport top inside that page, as a fraction of its height
+#   page_count: number of pages the folder had
+#   updated: time of the last change (seconds since the epoch)
+Position = namedtuple("Position", ["page", "offset", "page_count", "updated"])
+
+
+class ProgressStore:
+    """Reading positions of all folders, written in batches."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}  # folder -> Position not yet written
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS progress ("
+            " folder TEXT PRIMARY KEY, page INTEGER NOT NULL, offset REAL NOT NULL,"
+            " page_count INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS progress_updated ON progress (updated)")
+        self.writes = 0
+
+    @staticmethod
+    def key(folder):
+        return os.path.abspath(folder)
+
+    def get(self, folder):
+        """Return the saved Position of ``folder``, or None."""
+        key = self.key(folder)
+        with self._lock:
+            position = self._pending.get(key)
+            if position is not None:
+                return position
+            row = self._db.execute(
+                "SELECT page, offset, page_count, updated FROM progress WHERE folder = ?", (key,)).fetchone()
+        return Position(*row) if row is not None else None
+
+    def update(self, folder, page, offset, page_count):
+        """Remember a new position in memory; it is written by the next ``flush``."""
+        with self._lock:
+            self._pending[self.key(folder)] = Position(page, offset, page_count, time.time())
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    def flush(self):
+        """Write every pending position in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(folder,) + tuple(position) for folder, position in self._pending.items()]
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?)", rows)
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+            self._pending.clear()
+            self.writes += 1
+
+    def remove(self, folder):
+        key = self.key(folder)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._db.execute("DELETE FROM progress WHERE folder = ?", (key,))
+
+    def recent(self, limit=20):
+        """The ``limit`` most recently read folders as [(folder, Position)], newest first."""
+        self.flush()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT folder, page, offset, page_count, updated FROM progress"
+                " ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        return [(row[0], Position(*row[1:])) for row in rows]
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+QImage 与 NumPy 之间的转换，以及按分析结果直接生成输出 QImage。
+
+常见格式（RGB32/ARGB32、RGBA8888、RGB888、Grayscale8）直接共享 QImage 的内存，
+不做格式转换；输出图片保持与输入相同的像素布局，只需要一次按行复制。
+复制和分配的字节数记录在 ``stats`` 中，可以用来衡量每页的内存开销。
+"""
+import sys
+import threading
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+import perftrace
+import preprocess
+
+# Formats whose pixels can be used in place: format -> (channels, output format).
+# The output keeps the byte layout of the input; alpha is dropped by using the
+# matching opaque format, as the old OpenCV round trip did.
+NATIVE_FORMATS = {
+    QImage.Format_RGB888: (3, QImage.Format_RGB888),
+    QImage.Format_RGBA8888: (4, QImage.Format_RGBX8888),
+    QImage.Format_RGBX8888: (4, QImage.Format_RGBX8888),
+    QImage.Format_Grayscale8: (1, QImage.Format_Grayscale8),
+}
+if sys.byteorder == "little":
+    # 0xffRRGGBB words are stored as B, G, R, A bytes on little-endian machines.
+    NATIVE_FORMATS[QImage.Format_RGB32] = (4, QImage.Format_RGB32)
+    NATIVE_FORMATS[QImage.Format_ARGB32] = (4, QImage.Format_RGB32)
+BGR_FORMATS = {QImage.Format_RGB32, QImage.Format_ARGB32}
+# Sources whose fourth byte is real alpha; the opaque output formats need it set to 255.
+ALPHA_FORMATS = {QImage.Format_RGBA8888, QImage.Format_ARGB32}
+
+# Formats with no in-place layout (indexed, premultiplied, 16-bit, ...) are converted to this one.
+FALLBACK_FORMAT = QImage.Format_RGBA8888
+
+
+class BridgeStats:
+    """Thread-safe counters of the pixel memory touched by the bridge."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.conversions = 0        # QImage format conversions
+            self.allocations = 0        # New QImage pixel buffers (conversions included)
+            self.bytes_allocated = 0
+            self.bytes_copied = 0       # Pixel bytes written by the bridge (conversions included)
+
+    def add(self, allocations=0, allocated=0, copied=0, conversions=0):
+        with self._lock:
+            self.conversions += conversions
+            self.allocations += allocations
+            self.bytes_allocated += allocated
+            self.bytes_copied += copied
+
+    def snapshot(self):
+        with self._lock:
+            return dict(conversions=self.conversions, allocations=self.allocations,
+                        bytes_allocated=self.bytes_allocated, bytes_copied=self.bytes_copied)
+
+
+stats = BridgeStats()
+
+
+def _array(qimage, ptr, channels):
+    width, height = qimage.width(), qimage.height()
+    stride = qimage.bytesPerLine()
+    ptr.setsize(stride * height)
+    arr = np.frombuffer(ptr, dtype=np.uint8).reshape(height, stride)
+    if channels == 1:
+        return arr[:, :width]
+    return arr[:, :width * channels].reshape(height, width, channels)
+
+
+def qimage_view(qimage):
+    """
+    Expose the pixels of a QImage as an array without copying them when possible.
+
+    Images in one of NATIVE_FORMATS are used as they are; anything else is
+    converted to FALLBACK_FORMAT once. The array is (h, w) for grayscale and
+    (h, w, c) otherwise, and shares memory with the returned QImage, so the
+    caller must keep that image alive while the array is in use. Use
+    ``image.format()`` to tell the channel order.
+
+    :return: (array, image)
+    """
+    image = qimage
+    if qimage.format() not in NATIVE_FORMATS:
+        with perftrace.span("convert"):
+            image = qimage.convertToFormat(FALLBACK_FORMAT)
+        stats.add(allocations=1, allocated=image.sizeInBytes(), copied=image.sizeInBytes(), conversions=1)
+    return _array(image, image.constBits(), NATIVE_FORMATS[image.format()][0]), image
+
+
+def writable_view(qimage, channels):
+    """Expose the pixels of a freshly created QImage as a writable (h, w, channels) array."""
+    arr = _array(qimage, qimage.bits(), channels)
+    return arr[..., None] if channels == 1 else arr
+
+
+def rgb_view(arr, fmt):
+    """
+    View of an array from ``qimage_view`` with its colour channels in R, G, B order.
+
+    BGR byte orders are reversed with a negative stride and grayscale gets one
+    channel that broadcasts to three, so nothing is copied.
+    """
+    if arr.ndim == 2:
+        return arr[..., None]
+    if fmt in BGR_FORMATS:
+        return arr[..., 2::-1]
+    return arr[..., :3]
+
+
+def _new_image(width, height, fmt):
+    image = QImage(width, height, fmt)
+    stats.add(allocations=1, allocated=image.sizeInBytes())
+    return image
+
+
+def rgb_to_qimage(arr):
+    """Copy an (h, w, 3) RGB array into a new RGB888 QImage."""
+    height, width = arr.shape[:2]
+    image = _new_image(width, height, QImage.Format_RGB888)
+    if width and height:
+        writable_view(image, 3)[:] = arr
+        stats.add(copied=arr.nbytes)
+    return image
+
+
+def render_plan(arr, plan, fmt=None):
+    """
+    Build the output QImage for ``plan`` straight from the source array.
+
+    The kept rows are copied once into memory owned by the new QImage; no
+    intermediate images are created.
+
+    :param fmt: format of the image ``arr`` views (see qimage_view); if omitted
+                it is guessed from the number of channels
+    """
+    if fmt is None:
+        channels = 1 if arr.ndim == 2 else arr.shape[2]
+        fmt = {1: QImage.Format_Grayscale8, 3: QImage.Format_RGB888}.get(channels, QImage.Format_RGBA8888)
+    channels, out_format = NATIVE_FORMATS[fmt]
+    image = _new_image(plan.width, plan.height, out_format)
+    if plan.width and plan.height:
+        out = writable_view(image, channels)
+        preprocess.apply_plan(arr[..., None] if arr.ndim == 2 else arr, plan, out=out)
+        if fmt in ALPHA_FORMATS:
+            out[..., 3] = 255
+        stats.add(copied=out.nbytes)
+    return image
+
+
+def process_qimage(qimage, threshold=preprocess.DEFAULT_THRESHOLD,
+                   white_ratio=preprocess.DEFAULT_WHITE_RATIO,
+                   min_gap_height=preprocess.DEFAULT_MIN_GAP_HEIGHT, plan=None):
+    """
+    Crop the white border and remove internal white gaps in one pass.
+
+    :param plan: a previously computed PagePlan for this image; when it matches
+                 the image size the analysis is skipped and only the slice is done
+    :return: (processed QImage, PagePlan)
+    """
+    arr, image = qimage_view(qimage)
+    if plan is None or (plan.src_width, plan.src_height) != (qimage.width(), qimage.height()):
+        plan = preprocess.analyze(arr, threshold, white_ratio, min_gap_height)
+    return render_plan(arr, plan, image.format()), plan
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""程序缓存文件的存放位置。"""
+import os
+
+from PyQt5.QtCore import QStandardPaths
+
+APP_DIR_NAME = "MangaViewer"
+
+
+def cache_dir(*parts):
+    """
+    Return (and create) a directory under the per-user cache location.
+
+    :param parts: optional sub-directory names
+    """
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, APP_DIR_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_dir(*parts):
+    """
+    Return (and create) a directory under the per-user data location.
+
+    Unlike the cache, files here (reading progress) must not be deleted by
+    cache cleaners.
+    """
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation)
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".local", "share")
+    path = os.path.join(base, APP_DIR_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""preprocess 中跨页空白的处理：seam_trims 与 GapCollapser。"""
+import random
+
+import numpy as np
+import pytest
+
+from preprocess import GapCollapser, collapsed_gap, seam_trims, white_runs
+
+WIDTH = 4
+
+
+def page_flags(height, head, tail):
+    """White-row flags of a page with ``head`` white rows at the top and ``tail`` at the bottom."""
+    flags = np.zeros(height, dtype=bool)
+    flags[:head] = True
+    flags[height - tail:] = True
+    return flags
+
+
+def white_page(height):
+    return height, height, height
+
+
+def collapse_seams(edges, min_gap_height, keep_height):
+    """
+    Reference for seam_trims: the white-row flags of the whole strip with every
+    white run that touches a boundary between two pages with rows collapsed.
+    """
+    filled = [(h, head, tail) for h, head, tail in edges if h > 0]
+    flags = np.concatenate([page_flags(*edge) for edge in filled] or [np.zeros(0, dtype=bool)])
+    seams = set(np.cumsum([h for h, _, _ in filled])[:-1].tolist())
+    pieces, pos = [], 0
+    for start, stop in white_runs(flags):
+        pieces.append(flags[pos:start])
+        run = stop - start
+        if start in seams or stop in seams or any(start < seam < stop for seam in seams):
+            run = collapsed_gap(run, min_gap_height, keep_height)
+        pieces.append(np.ones(run, dtype=bool))
+        pos = stop
+    pieces.append(flags[pos:])
+    return np.concatenate(pieces)
+
+
+def trimmed(edges, trims):
+    """The white-row flags of the strip with the rows hidden by ``trims`` left out."""
+    pieces = []
+    for (height, head, tail), (top, bottom) in zip(edges, trims):
+        assert 0 <= top and 0 <= bottom and top + bottom <= height
+        flags = page_flags(height, head, tail)
+        # Only white rows may be hidden.
+        assert flags[:top].all() and flags[height - bottom:].all()
+        pieces.append(flags[top:height - bottom])
+    return np.concatenate(pieces or [np.zeros(0, dtype=bool)])
+
+
+def check_seams(edges, min_gap_height, keep_height):
+    trims = seam_trims(edges, min_gap_height, keep_height)
+    assert len(trims) == len(edges)
+    np.testing.assert_array_equal(trimmed(edges, trims), collapse_seams(edges, min_gap_height, keep_height))
+    return trims
+
+
+def test_seam_run_across_one_boundary():
+    edges = [(300, 10, 60), (300, 70, 20)]
+    assert check_seams(edges, 100, 0) == [(0, 60), (70, 0)]
+
+
+def test_seam_run_spans_white_pages():
+    edges = [(300, 0, 50), white_page(200), white_page(100), (300, 30, 0)]
+    assert check_seams(edges, 100, 0) == [(0, 50), (200, 0), (100, 0), (30, 0)]
+
+
+def test_keep_height_keeps_rows_next_to_content():
+    edges = [(300, 0, 50), white_page(200), (300, 30, 0)]
+    # The first 80 rows of the run stay: all of the tail and 30 rows of the white page.
+    assert check_seams(edges, 100, 80) == [(0, 0), (170, 0), (30, 0)]
+    assert check_seams(edges, 100, 20) == [(0, 30), (200, 0), (30, 0)]
+
+
+@pytest.mark.parametrize("run, collapsed", [(99, False), (100, True), (101, True)])
+def test_min_gap_height_boundary(run, collapsed):
+    edges = [(300, 0, run - 40), (300, 40, 0)]
+    trims = check_seams(edges, 100, 0)
+    assert trims == ([(0, run - 40), (40, 0)] if collapsed else [(0, 0), (0, 0)])
+
+
+def test_white_at_the_ends_is_not_a_seam():
+    edges = [(300, 150, 150)]
+    assert check_seams(edges, 100, 0) == [(0, 0)]
+    edges = [(300, 150, 10), (300, 10, 150)]
+    assert check_seams(edges, 100, 0) == [(0, 0), (0, 0)]
+
+
+def test_zero_height_pages():
+    # Failed pages in the middle are part of the run; at the ends they are ignored.
+    edges = [(0, 0, 0), (300, 120, 60), (0, 0, 0), (300, 50, 0), (0, 0, 0)]
+    assert check_seams(edges, 100, 0) == [(0, 0), (0, 60), (0, 0), (50, 0), (0, 0)]
+    assert check_seams([(0, 0, 0), (0, 0, 0)], 100, 0) == [(0, 0), (0, 0)]
+    assert check_seams([], 100, 0) == []
+
+
+def random_edges(rng):
+    edges = []
+    for _ in range(rng.randint(0, 8)):
+        kind = rng.random()
+        if kind < 0.2:
+            edges.append((0, 0, 0))
+        elif kind < 0.4:
+            edges.append(white_page(rng.randint(1, 150)))
+        else:
+            height = rng.randint(2, 300)
+            head = rng.randint(0, height - 1)
+            edges.append((height, head, rng.randint(0, height - 1 - head)))
+    return edges
+
+
+def test_seam_trims_matches_reference():
+    rng = random.Random(11)
+    for _ in range(2000):
+        check_seams(random_edges(rng), rng.randint(1, 200), rng.choice((0, 0, 10, 60, 250)))
+
+
+def page_rows(height, head, tail):
+    """A page whose white rows are 255 and whose content rows are dark."""
+    arr = np.zeros((height, WIDTH, 3), dtype=np.uint8)
+    arr[page_flags(height, head, tail)] = 255
+    return arr
+
+
+def collapse(pages, min_gap_height, keep_height):
+    collapser = GapCollapser(min_gap_height=min_gap_height, keep_height=keep_height)
+    out = []
+    for arr in pages:
+        out += collapser.push(arr)
+    out += collapser.finish()
+    assert collapser.rows_in == sum(len(arr) for arr in pages)
+    assert collapser.rows_out == sum(len(rows) for rows in out)
+    return np.concatenate(out or [np.zeros((0, WIDTH, 3), dtype=np.uint8)])
+
+
+def collapse_naive(pages, min_gap_height, keep_height):
+    """Reference for GapCollapser: concatenate every page, then shorten each white run."""
+    rows = np.concatenate(pages or [np.zeros((0, WIDTH, 3), dtype=np.uint8)])
+    flags = rows.min(axis=(1, 2)) == 255
+    keep = np.ones(len(rows), dtype=bool)
+    for start, stop in white_runs(flags):
+        keep[start + collapsed_gap(stop - start, min_gap_height, keep_height):stop] = False
+    return rows[keep]
+
+
+def test_gap_collapser_matches_reference():
+    rng = random.Random(7)
+    for _ in range(500):
+        pages = [page_rows(*edge) for edge in random_edges(rng)]
+        min_gap_height, keep_height = rng.randint(1, 200), rng.choice((0, 10, 60, 250))
+        np.testing.assert_array_equal(collapse(pages, min_gap_height, keep_height),
+                                      collapse_naive(pages, min_gap_height, keep_height))
+
+
+def test_gap_collapser_collapses_runs_across_pages():
+    pages = [page_rows(300, 0, 60), np.zeros((0, WIDTH, 3), dtype=np.uint8), page_rows(200, 200, 200),
+             page_rows(300, 70, 0)]
+    out = collapse(pages, 100, 40)
+    assert len(out) == 240 + 40 + 230
+    flags = out.min(axis=(1, 2)) == 255
+    assert [tuple(run) for run in white_runs(flags)] == [(240, 280)]
+
+
+def test_gap_collapser_rejects_other_widths():
+    collapser = GapCollapser()
+    collapser.push(page_rows(10, 0, 0))
+    with pytest.raises(ValueError):
+        collapser.push(np.zeros((10, WIDTH + 1, 3), dtype=np.uint8))
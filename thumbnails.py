@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+章节缩略图图集。
+
+每页的缩略图按固定大小的格子排进一张图集图片，整章的缩略图保存为一个 JPEG
+文件和一个记录来源签名、已完成页的 JSON 文件，打开时在后台线程中读一次文件
+即可。缺少的缩略图由后台线程按批生成：JPEG 按缩略图宽度直接缩小解码，从当前页
+向前后两侧依次进行；线程数很少，不影响滚动时的页面解码。
+"""
+import hashlib
+import json
+import logging
+import os
+
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+import perftrace
+from chapterpack import source_signature
+from loader import decode_scale, image_reader, read_image
+
+log = logging.getLogger(__name__)
+
+THUMB_WIDTH = 96
+THUMB_HEIGHT = 144      # Taller pages keep their top part
+ATLAS_COLUMNS = 16
+BATCH_PAGES = 8         # Pages per background job
+JPEG_QUALITY = 85
+BACKGROUND = QColor(40, 40, 40)
+
+
+def cell_origin(index):
+    """Top-left corner of thumbnail ``index`` in the atlas."""
+    row, column = divmod(index, ATLAS_COLUMNS)
+    return column * THUMB_WIDTH, row * THUMB_HEIGHT
+
+
+def make_thumbnail(path):
+    """
+    Decode ``path`` at the smallest size that still covers THUMB_WIDTH and scale it to that width.
+
+    :return: QImage at most THUMB_HEIGHT rows tall (null if decoding failed)
+    """
+    reader = image_reader(path)
+    size = reader.size()
+    scale = decode_scale(size.width(), THUMB_WIDTH) if size.isValid() else 1
+    image = read_image(path, scale, reader)
+    if image.isNull():
+        return image
+    image = image.scaledToWidth(THUMB_WIDTH, Qt.SmoothTransformation)
+    if image.height() > THUMB_HEIGHT:
+        image = image.copy(0, 0, THUMB_WIDTH, THUMB_HEIGHT)
+    return image
+
+
+class ThumbnailAtlas:
+    """
+    Thumbnails of one chapter in a grid image, stored as ``<name>.jpg`` + ``<name>.json``.
+
+    ``done`` is the set of pages whose cell has been filled.
+    """
+
+    def __init__(self, directory, folder, paths):
+        self.folder = os.path.abspath(folder)
+        self.count = len(paths)
+        self.signature = source_signature(paths)
+        name = hashlib.sha1(self.folder.encode("utf-8")).hexdigest()
+        self.image_path = os.path.join(directory, name + ".jpg")
+        self.meta_path = os.path.join(directory, name + ".json")
+        rows = max(1, -(-self.count // ATLAS_COLUMNS))
+        self.image = QImage(ATLAS_COLUMNS * THUMB_WIDTH, rows * THUMB_HEIGHT, QImage.Format_RGB888)
+        self.image.fill(BACKGROUND)
+        self.done = set()
+        self.dirty = False
+
+    def load(self):
+        """Read a saved atlas of the same sources; return False if there is none."""
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta.get("signature") != self.signature or meta.get("columns") != ATLAS_COLUMNS \
+                or meta.get("cell") != [THUMB_WIDTH, THUMB_HEIGHT]:
+            return False
+        image = QImage(self.image_path)
+        if image.size() != self.image.size():
+            return False
+        self.image = image.convertToFormat(QImage.Format_RGB888)
+        self.done = set(meta.get("done", ()))
+        return True
+
+    def save(self):
+        """Write the atlas (complete or not) if it changed since it was loaded or saved."""
+        if not self.dirty:
+            return
+        tmp = self.image_path + ".tmp.jpg"
+        if not self.image.save(tmp, "JPG", JPEG_QUALITY):
+            return
+        os.replace(tmp, self.image_path)
+        meta = dict(signature=self.signature, columns=ATLAS_COLUMNS, cell=[THUMB_WIDTH, THUMB_HEIGHT],
+                    done=sorted(self.done))
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, separators=(",", ":"))
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+        self.dirty = False
+
+    def put(self, index, thumbnail):
+        """Draw ``thumbnail`` (may be null for a page that failed) into its cell."""
+        x, y = cell_origin(index)
+        painter = QPainter(self.image)
+        painter.fillRect(x, y, THUMB_WIDTH, THUMB_HEIGHT, BACKGROUND)
+        if not thumbnail.isNull():
+            painter.drawImage(x, y, thumbnail)
+        painter.end()
+        self.done.add(index)
+        self.dirty = True
+
+    def is_complete(self):
+        return len(self.done) >= self.count
+
+
+class ThumbnailJob(QRunnable):
+    """Make the thumbnails of a few pages on a worker thread."""
+
+    def __init__(self, builder, generation, items):
+        super().__init__()
+        self.builder = builder
+        self.generation = generation
+        self.items = items  # [(index, path)]
+
+    def run(self):
+        QThread.currentThread().setPriority(QThread.LowPriority)
+        for index, path in self.items:
+            if self.generation != self.builder.generation:
+                return
+            try:
+                with perftrace.span("thumbnail", index=index):
+                    image = make_thumbnail(path)
+            except Exception as exc:  # Never let an exception escape into Qt.
+                log.warning("生成缩略图失败 %s: %s", path, exc)
+                image = QImage()
+            self.builder._thumbnail_done.emit(self.generation, index, image)
+
+
+class AtlasJob(QRunnable):
+    """Save the atlas of the previous chapter and load the atlas of the next one on a worker thread."""
+
+    def __init__(self, builder, generation, previous, folder, paths):
+        super().__init__()
+        self.builder = builder
+        self.generation = generation
+        self.previous = previous
+        self.folder = folder
+        self.paths = paths
+
+    def run(self):
+        atlas = None
+        try:
+            with perftrace.span("thumbnail_atlas_load"):
+                if self.previous is not None:
+                    self.previous.save()
+                atlas = ThumbnailAtlas(self.builder.directory, self.folder, self.paths)
+                atlas.load()
+        except Exception as exc:  # Never let an exception escape into Qt.
+            log.warning("读取缩略图图集失败 %s: %s", self.folder, exc)
+        self.builder._atlas_done.emit(self.generation, atlas)
+
+
+class ThumbnailBuilder(QObject):
+    """
+    Owns the atlas of the current chapter and fills in its missing thumbnails.
+
+    Opening another chapter abandons the pending jobs of the current atlas; the
+    current atlas is saved and the next one loaded in the background, so
+    ``atlas`` is None until ``opened`` is emitted.
+    """
+
+    opened = pyqtSignal()
+    thumbnail_ready = pyqtSignal(int)  # index
+    finished = pyqtSignal()
+
+    _atlas_done = pyqtSignal(int, object)  # generation, ThumbnailAtlas or None
+    _thumbnail_done = pyqtSignal(int, int, object)  # generation, index, QImage
+
+    def __init__(self, directory, threads=1, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.atlas = None
+        self.generation = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, threads))
+        # Atlas files are saved and loaded one at a time, in order.
+        self.file_pool = QThreadPool(self)
+        self.file_pool.setMaxThreadCount(1)
+        self._paths = []
+        self._started = False
+        self._focus = None      # Page to start from once the atlas is loaded
+        self._atlas_done.connect(self._on_atlas_done)
+        self._thumbnail_done.connect(self._on_thumbnail_done)
+
+    def open(self, folder, paths):
+        """Load the saved atlas of ``folder`` (or start an empty one) in the background; nothing is built yet."""
+        previous = self._release()
+        self._paths = list(paths)
+        self.file_pool.start(AtlasJob(self, self.generation, previous, folder, self._paths))
+
+    def start(self, focus=0):
+        """Queue the missing thumbnails, nearest to page ``focus`` first."""
+        if self._started:
+            return
+        if self.atlas is None:
+            self._focus = focus
+            return
+        self._started = True
+        missing = sorted((i for i in range(len(self._paths)) if i not in self.atlas.done),
+                         key=lambda i: (abs(i - focus), i < focus))
+        for k in range(0, len(missing), BATCH_PAGES):
+            batch = [(i, self._paths[i]) for i in missing[k:k + BATCH_PAGES]]
+            self.pool.start(ThumbnailJob(self, self.generation, batch))
+
+    def is_building(self):
+        return self._started and self.atlas is not None and not self.atlas.is_complete()
+
+    def close(self):
+        """Save and drop the current atlas; pending jobs for it finish without effect."""
+        atlas = self._release()
+        if atlas is not None:
+            atlas.save()
+
+    def shutdown(self):
+        self.close()
+        self.file_pool.waitForDone()
+        self.pool.waitForDone()
+
+    def _release(self):
+        """Abandon the jobs of the current atlas and return it."""
+        self.generation += 1
+        self._started = False
+        self._focus = None
+        self.pool.clear()
+        atlas, self.atlas = self.atlas, None
+        return atlas
+
+    def _on_atlas_done(self, generation, atlas):
+        if generation != self.generation or atlas is None:
+            return
+        self.atlas = atlas
+        self.opened.emit()
+        focus, self._focus = self._focus, None
+        if focus is not None:
+            self.start(focus)
+
+    def _on_thumbnail_done(self, generation, index, image):
+        if generation != self.generation or self.atlas is None:
+            return
+        self.atlas.put(index, image)
+        self.thumbnail_ready.emit(index)
+        if self.atlas.is_complete():
+            self.atlas.save()
+            self.finished.emit()
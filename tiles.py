@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+超长条图片的分块。
+
+处理后高度超过 TALL_PAGE_ROWS 的图片按 TILE_ROWS 行切成若干块，每块单独读取、
+缩放和淘汰。由于 PNG 等格式无法按区域解码，这类图片第一次打开时完整解码一次，
+把去白边后的行逐块写入缓存目录中的原始像素文件，之后每块都通过 np.memmap
+直接切片读取，内存占用只与视口有关。
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import preprocess
+
+TILE_ROWS = 2048        # Processed rows per tile
+TALL_PAGE_ROWS = 8192   # Pages taller than this (after processing) are tiled
+CHANNELS = 3            # Tiles are stored as RGB888
+DEFAULT_SPILL_MB = 2048
+
+
+def is_tall(height):
+    return height > TALL_PAGE_ROWS
+
+
+def tile_count(height):
+    return -(-height // TILE_ROWS) if is_tall(height) else 1
+
+
+def tile_rows(height, tile):
+    """Processed row range [y0, y1) covered by ``tile``."""
+    if not is_tall(height):
+        return 0, height
+    return tile * TILE_ROWS, min(height, (tile + 1) * TILE_ROWS)
+
+
+def display_band(width, height, display_width, tile):
+    """
+    Display row range [a, b) of ``tile`` relative to the page top.
+
+    Band edges use the same rounding as the page height, so the bands of all
+    tiles add up exactly to the page's display height.
+    """
+    y0, y1 = tile_rows(height, tile)
+    a = int(y0 * display_width / width)
+    b = max(1, int(y1 * display_width / width)) if y1 == height else int(y1 * display_width / width)
+    return a, b
+
+
+def tile_bands(width, height, display_width):
+    """Return [(tile, a, b), ...] for every tile of a width x height page."""
+    return [(t,) + display_band(width, height, display_width, t) for t in range(tile_count(height))]
+
+
+def trim_directory(directory, suffix, max_bytes, keep=None):
+    """
+    Delete the least recently used ``*suffix`` files of ``directory`` until their total size fits in ``max_bytes``.
+
+    Files are ordered by modification time, which the stores refresh whenever
+    a file is used; ``keep`` is never deleted.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+class TileStore:
+    """
+    Raw processed rows of tall pages, stored as files and read back with np.memmap.
+
+    Files are named after the source file, its signature and the preprocessing
+    parameters, so a changed source simply gets a new file; the total size is
+    capped and the least recently used files are deleted first.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_SPILL_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def name(path, signature, params):
+        text = "{}|{}|{}|{}".format(path, signature[0], signature[1], sorted(params.items()))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _file(self, name, plan):
+        return os.path.join(self.directory, "{}_{}x{}.rgb".format(name, plan.width, plan.height))
+
+    def open(self, name, plan):
+        """Return a read-only (h, w, 3) memmap of the processed page, or None if not stored."""
+        path = self._file(name, plan)
+        try:
+            os.utime(path)  # Mark as recently used.
+            return np.memmap(path, dtype=np.uint8, mode="r", shape=(plan.height, plan.width, CHANNELS))
+        except (OSError, ValueError):
+            return None
+
+    def write(self, name, arr, plan):
+        """
+        Write the processed rows of ``arr`` tile by tile.
+
+        :param arr: decoded source array in R, G, B order (see qtimage.rgb_view);
+                    its first three channels are stored
+        """
+        path = self._file(name, plan)
+        tmp = "{}.{}.tmp".format(path, threading.get_ident())
+        out = np.memmap(tmp, dtype=np.uint8, mode="w+", shape=(plan.height, plan.width, CHANNELS))
+        for tile in range(tile_count(plan.height)):
+            y0, y1 = tile_rows(plan.height, tile)
+            preprocess.apply_plan(arr[..., :CHANNELS], plan, out=out[y0:y1], band=(y0, y1))
+        out.flush()
+        del out
+        os.replace(tmp, path)
+        with self._lock:
+            trim_directory(self.directory, ".rgb", self.max_bytes, keep=path)